@@ -0,0 +1,79 @@
+"""
+Memory use and aggregation time of the columnar holdings table Portfolio keeps against the dict of Asset objects
+it used to keep, run from the repository root with `python -m benchmarks.bench_holdings [holding_count]`
+"""
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+from src import holdings
+from src.asset import Asset
+from src.holdings import HoldingsTable
+
+ASSETS_PER_ADDRESS = 10
+ASSET_NAMES = ['ASSET{0}'.format(i) for i in range(500)]
+
+def address_balances(holding_count):
+    """
+    yields (address, {asset_name:balance, }) of ASSETS_PER_ADDRESS assets for holding_count holdings, balances are
+    Decimals of floats as Portfolio makes them from json api responses
+    """
+    for i in range(holding_count // ASSETS_PER_ADDRESS):
+        yield 'addr{0}'.format(i), {ASSET_NAMES[(i + j) % len(ASSET_NAMES)]: Decimal((i % 997) / 7 + j)
+                                    for j in range(ASSETS_PER_ADDRESS)}
+
+def build_addr_assets(holding_count):
+    return {addr: {asset_name: Asset(balance) for asset_name, balance in balances.items()}
+            for addr, balances in address_balances(holding_count)}
+
+def build_table(holding_count):
+    T = HoldingsTable()
+    for addr, balances in address_balances(holding_count):
+        T.set_address(addr, balances)
+    return T
+
+def dict_filter_totals(addr_assets, min_balance, excluded_assets):
+    """
+    filter_addr_assets() followed by get_asset_totals() as Portfolio does them
+    """
+    asset_totals = {}
+    for asset_data in addr_assets.values():
+        for asset_name, asset_obj in asset_data.items():
+            if asset_name not in excluded_assets and asset_obj.balance > min_balance:
+                asset_totals[asset_name] = asset_totals.get(asset_name, 0) + asset_obj.balance
+    return asset_totals
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def traced(fn, *args):
+    tracemalloc.start()
+    result = fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+def main(holding_count=1000000):
+    excluded_assets = ASSET_NAMES[:5]
+    addr_assets, dict_bytes = traced(build_addr_assets, holding_count)
+    table, table_bytes = traced(build_table, holding_count)
+
+    dict_totals, dict_secs = timed(dict_filter_totals, addr_assets, 1, excluded_assets)
+    table_totals, table_secs = timed(lambda: table.filter(1, excluded_assets).asset_totals())
+    # table balances are rounded to SCALE_DIGITS decimal places, so totals agree to within half a unit per holding
+    for asset_name, total in dict_totals.items():
+        assert abs(total - table_totals[asset_name]) <= Decimal(len(table)).scaleb(-holdings.SCALE_DIGITS) / 2
+    print('{0} holdings, numpy {1}, {2} too large for the balance column'.format(
+            len(table), 'enabled' if holdings.numpy is not None else 'not installed', len(table.overflow)))
+
+    print('dict of Asset memory.........{0:.1f} MB'.format(dict_bytes / 2**20))
+    print('holdings table memory........{0:.1f} MB ({1:.1f} MB of columns)'.format(table_bytes / 2**20,
+                                                                                table.nbytes() / 2**20))
+    print('dict filter + totals.........{0:.4f}s'.format(dict_secs))
+    print('table filter + totals........{0:.4f}s'.format(table_secs))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
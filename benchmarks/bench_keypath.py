@@ -0,0 +1,66 @@
+"""
+Microbenchmark comparing the old eval based json_value_by_key with the compiled key paths used by Family,
+run from the repository root with `python -m benchmarks.bench_keypath [asset_count]`
+"""
+import sys
+import time
+import inspect
+
+from src import util
+
+def merge_lst(lst, delimeters=['', '']):
+    lst_str = ''
+    for element in lst:
+        lst_str += delimeters[0] + element + delimeters[1]
+    return lst_str
+
+def rev_eval(variable):
+    callers_local_vars = inspect.currentframe().f_back.f_locals.items()
+    return [k for k,v in callers_local_vars if v is variable][0]
+
+def eval_json_value_by_key(json_obj, key_lst=[]):
+    """
+    json_value_by_key as it was implemented before key paths were compiled
+    """
+    json_key_path = merge_lst(key_lst, ['[\'', '\']'])
+    str_stmt = rev_eval(json_obj) + json_key_path
+    return eval(str_stmt)
+
+def build_response(asset_count):
+    return {'data': [{'asset': 'ASSET{0}'.format(i), 'balance': i} for i in range(asset_count)]}
+
+def run_eval(json_resp):
+    total = 0
+    for asset_data in eval_json_value_by_key(json_resp, ['data']):
+        eval_json_value_by_key(asset_data, ['asset'])
+        total += eval_json_value_by_key(asset_data, ['balance'])
+    return total
+
+def run_compiled(json_resp):
+    get_data = util.compile_key_path(['data'])
+    get_id = util.compile_key_path(['asset'])
+    get_balance = util.compile_key_path(['balance'])
+    total = 0
+    for asset_data in get_data(json_resp):
+        get_id(asset_data)
+        total += get_balance(asset_data)
+    return total
+
+def timed(fn, arg):
+    start = time.perf_counter()
+    result = fn(arg)
+    return result, time.perf_counter() - start
+
+def main(asset_count=100000):
+    json_resp = build_response(asset_count)
+    eval_total, eval_secs = timed(run_eval, json_resp)
+    compiled_total, compiled_secs = timed(run_compiled, json_resp)
+    assert eval_total == compiled_total
+
+    print('{0} assets'.format(asset_count))
+    print('eval key path........{0:.4f}s'.format(eval_secs))
+    print('compiled key path....{0:.4f}s'.format(compiled_secs))
+    print('speedup..............{0:.1f}x'.format(eval_secs / compiled_secs))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
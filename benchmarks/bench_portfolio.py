@@ -0,0 +1,101 @@
+"""
+End to end Portfolio and Prices benchmark against local stand-in apis, run from the repository root with
+`python -m benchmarks.bench_portfolio [--sizes 10,1000,100000] [--latency s] [--error-rate p] [--payload n]`
+reports wall time, peak RSS and request count per address count, and stores them in benchmarks/results/<commit>.json
+so that `--compare <commit>` can show regressions between commits
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+from benchmarks.standins import StandInServer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results')
+
+def run_worker(addr_count, addr_config_json, price_config_json):
+    """
+    builds a Portfolio of addr_count addresses split across the stand-in families and prices it, in this process
+    """
+    from src import portfolio, providers
+
+    providers.default_registry.configure(json.loads(price_config_json))
+    addr_config = json.loads(addr_config_json)
+    families = sorted(addr_config)
+    addr_data = {family: ['{0}{1}'.format(family.lower(), i) for i in range(addr_count) if i % len(families) == idx]
+                 for idx, family in enumerate(families)}
+
+    start = time.perf_counter()
+    P = portfolio.Portfolio(addr_data, addr_config)
+    P.filter_addr_assets(0)
+    P.retrieve_asset_prices('USD,BTC')
+    P.get_asset_totals()
+    wall_time = time.perf_counter() - start
+
+    print(json.dumps({'wall_time': wall_time,
+                      'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      'failed_addresses': sum(len(addr_lst) for addr_lst in P.failed_addresses.values())}))
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    print('compared with {0}'.format(baseline['commit']))
+    for size, result in results['runs'].items():
+        if size not in baseline['runs']:
+            continue
+        base = baseline['runs'][size]
+        print('{0} addresses: wall time {1:+.1%}, peak RSS {2:+.1%}, requests {3:+d}'.format(
+                size, result['wall_time'] / base['wall_time'] - 1,
+                result['peak_rss_kb'] / base['peak_rss_kb'] - 1,
+                result['request_count'] - base['request_count']))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,1000,100000')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--payload', type=int, default=10)
+    parser.add_argument('--compare', metavar='COMMIT')
+    parser.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return run_worker(int(args.worker[0]), args.worker[1], args.worker[2])
+
+    server = StandInServer(args.latency, args.error_rate, args.payload).start()
+    results = {'commit': current_commit(), 'time': time.time(),
+               'settings': {'latency': args.latency, 'error_rate': args.error_rate, 'payload': args.payload},
+               'runs': {}}
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            requests_before = server.request_count
+            output = subprocess.check_output(
+                    [sys.executable, '-m', 'benchmarks.bench_portfolio', '--worker', str(size),
+                     json.dumps(server.address_config()), json.dumps(server.price_config())], text=True)
+            run = json.loads(output.strip().splitlines()[-1])
+            run['request_count'] = server.request_count - requests_before
+            results['runs'][str(size)] = run
+            print('{0} addresses: {1:.3f}s, peak RSS {2:.1f} MB, {3} requests, {4} failed addresses'.format(
+                    size, run['wall_time'], run['peak_rss_kb'] / 1024, run['request_count'], run['failed_addresses']))
+    finally:
+        server.stop()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_file = os.path.join(RESULTS_DIR, '{0}.json'.format(results['commit']))
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+    print('results written to {0}'.format(results_file))
+    if args.compare:
+        compare(results, os.path.join(RESULTS_DIR, '{0}.json'.format(args.compare)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
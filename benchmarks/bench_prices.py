@@ -0,0 +1,86 @@
+"""
+Wall time and peak traced memory of fetching the price feeds from a local stand-in api, decoding the whole feed
+with json.loads as before against decoding it one ticker at a time, with and without a set of wanted assets,
+run from the repository root with `python -m benchmarks.bench_prices [ticker_count]`
+each mode runs in its own worker process so the stand-in server's allocations are not traced
+"""
+import sys
+import json
+import time
+import subprocess
+import tracemalloc
+from decimal import Decimal
+
+from benchmarks.standins import StandInServer
+
+MODES = ['json.loads', 'streaming', 'streaming, 10 wanted assets']
+WANTED_ASSETS = {'BTC', 'ETH'} | {'ASSET{0}'.format(i) for i in range(8)}
+TIME_RUNS = 5
+
+def loads_tickers(price_base_url):
+    """
+    the price feeds decoded whole with json.loads, as Prices._fetch_tickers() did before it streamed them
+    """
+    from src import util
+
+    crypto_symbols, crypto_names, fiat_symbols = {}, {}, {}
+    for ticker in util.api_call(price_base_url, 'listCoins'):
+        btc_price = Decimal(ticker['price_btc'])
+        if btc_price > 0:
+            crypto_symbols[ticker['id'].upper()] = btc_price
+            crypto_names[ticker['name'].upper()] = btc_price
+    for ticker in util.api_call(price_base_url, 'markets.json'):
+        if ticker['bid']:
+            fiat_symbols[ticker['currency']] = Decimal(ticker['bid'])
+    return crypto_symbols, crypto_names, fiat_symbols
+
+def run_worker(mode, price_config_json, measure):
+    """
+    prints json {'seconds':wall_time} or {'peak_bytes':peak_traced_memory} of fetching the price feeds in mode
+    time and memory are measured in separate runs since tracing allocations slows decoding down, the time is the
+    best of TIME_RUNS runs
+    """
+    from src import asset, providers
+
+    providers.default_registry.configure(json.loads(price_config_json))
+    price_base_url = providers.default_registry.asset_classes['FIAT']['providers'][0].api_base
+    if mode == MODES[0]:
+        fetch = lambda: loads_tickers(price_base_url)
+    else:
+        fetch = lambda: asset.Prices(assets=WANTED_ASSETS if mode == MODES[2] else None)._tickers()
+    fetch()  # warms up the connection pool and imports
+
+    if measure == 'time':
+        result = {'seconds': float('inf')}
+        for run in range(TIME_RUNS):
+            start = time.perf_counter()
+            tickers = fetch()
+            result['seconds'] = min(result['seconds'], time.perf_counter() - start)
+    else:
+        tracemalloc.start()
+        tickers = fetch()
+        result = {'peak_bytes': tracemalloc.get_traced_memory()[1]}
+        tracemalloc.stop()
+    result['tickers'] = len(tickers[0])
+    print(json.dumps(result))
+
+def main(ticker_count=50000):
+    server = StandInServer(payload_size=ticker_count).start()
+    try:
+        print('{0} cryptocurrency tickers'.format(ticker_count))
+        for mode in MODES:
+            run = {}
+            for measure in ('time', 'memory'):
+                output = subprocess.check_output([sys.executable, '-m', 'benchmarks.bench_prices', '--worker', mode,
+                                                  json.dumps(server.price_config()), measure], text=True)
+                run.update(json.loads(output.strip().splitlines()[-1]))
+            print('{0}{1}{2:.3f}s, peak {3:.1f} MB, {4} tickers kept'.format(
+                    mode, '.' * (32 - len(mode)), run['seconds'], run['peak_bytes'] / 2**20, run['tickers']))
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--worker']:
+        run_worker(*sys.argv[2:5])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
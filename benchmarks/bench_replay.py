@@ -0,0 +1,73 @@
+"""
+Wall time of a Portfolio and Prices run recorded against local stand-in apis against replaying it from its archive
+with the stand-ins stopped, run from the repository root with
+`python -m benchmarks.bench_replay [address_count] [--latency s] [--error-rate p]`
+the replayed totals and failed addresses are checked against the recorded run
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+from benchmarks.standins import StandInServer
+
+def evaluate(addr_data, addr_config, A):
+    """
+    returns (wall_time, asset_totals, failed_addresses) of a run with archive A active
+    """
+    from src import portfolio, archive
+
+    archive.active = A
+    try:
+        start = time.perf_counter()
+        P = portfolio.Portfolio(addr_data, addr_config)
+        P.filter_addr_assets(0)
+        P.retrieve_asset_prices('USD,BTC', refresh=True)
+        totals = {asset_name: (balance, P.asset_values(asset_name, balance))
+                  for asset_name, balance in P.get_asset_totals().items()}
+        return time.perf_counter() - start, totals, P.failed_addresses
+    finally:
+        archive.active = None
+        A.close()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('address_count', type=int, nargs='?', default=100000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    from src import providers, archive
+
+    server = StandInServer(args.latency, args.error_rate).start()
+    providers.default_registry.configure(server.price_config())
+    addr_config = server.address_config()
+    families = sorted(addr_config)
+    addr_data = {family: ['{0}{1}'.format(family.lower(), i) for i in range(args.address_count)
+                          if i % len(families) == idx]
+                 for idx, family in enumerate(families)}
+    archive_file = os.path.join(tempfile.mkdtemp(), 'run.archive.gz')
+    try:
+        record_time, recorded_totals, recorded_failed = evaluate(addr_data, addr_config,
+                                                                 archive.ResponseArchive(archive_file, 'record'))
+    finally:
+        server.stop()
+    request_count = server.request_count
+
+    load_start = time.perf_counter()
+    A = archive.ResponseArchive(archive_file, 'replay')
+    load_time = time.perf_counter() - load_start
+    replay_time, replayed_totals, replayed_failed = evaluate(addr_data, addr_config, A)
+
+    print('{0} addresses, {1} requests, {2} responses archived in {3:.1f} MB'.format(
+            args.address_count, request_count, A.count, os.path.getsize(archive_file) / 2**20))
+    print('recorded run{0}{1:.3f}s'.format('.' * 20, record_time))
+    print('replayed run{0}{1:.3f}s, {2:.3f}s of it loading the archive'.format('.' * 20, replay_time + load_time,
+                                                                                load_time))
+    print('replay matches recording: {0}'.format(replayed_totals == recorded_totals and
+                                                 replayed_failed == recorded_failed))
+    os.remove(archive_file)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,56 @@
+"""
+Wall time of config only cryptobalances.py invocations such as `address --add`, run from the repository root with
+`python -m benchmarks.bench_startup [invocation_count]`
+commands run against a copy of the application in a temporary directory so the real address store is left untouched
+"""
+import os
+import sys
+import time
+import glob
+import shutil
+import tempfile
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def copy_app(dest_dir):
+    """
+    copies cryptobalances.py, the src package and the address config to dest_dir without any user data
+    """
+    shutil.copy(os.path.join(REPO_DIR, 'cryptobalances.py'), dest_dir)
+    os.mkdir(os.path.join(dest_dir, 'src'))
+    for file_path in glob.glob(os.path.join(REPO_DIR, 'src', '*.py')) + [os.path.join(REPO_DIR, 'src', 'address_config.json')]:
+        shutil.copy(file_path, os.path.join(dest_dir, 'src'))
+
+def timed_runs(app_dir, commands):
+    """
+    returns list of wall times in seconds of running each command in commands, a list of argument lists
+    """
+    times = []
+    for command in commands:
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + command, cwd=app_dir, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def main(invocation_count=50):
+    app_dir = tempfile.mkdtemp()
+    try:
+        copy_app(app_dir)
+        benchmarks = [('python -c pass', [['-c', 'pass']] * invocation_count),
+                      ('address --add', [['cryptobalances.py', 'address', '--add', 'btc', 'addr{0}'.format(i)]
+                                         for i in range(invocation_count)]),
+                      ('address', [['cryptobalances.py', 'address']] * invocation_count),
+                      ('exclusion --add', [['cryptobalances.py', 'exclusion', '--add', 'ASSET{0}'.format(i)]
+                                           for i in range(invocation_count)])]
+        print('{0} invocations each'.format(invocation_count))
+        for name, commands in benchmarks:
+            times = timed_runs(app_dir, commands)
+            print('{0}{1}median {2:.1f} ms, max {3:.1f} ms'.format(name, '.' * (24 - len(name)),
+                                                                    statistics.median(times) * 1e3, max(times) * 1e3))
+    finally:
+        shutil.rmtree(app_dir)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,130 @@
+"""
+Local stand-ins for the address and price apis used by Portfolio and Prices, with configurable latency,
+error rate and payload size
+"""
+import json
+import time
+import hashlib
+import random
+from threading import Lock, Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StandInServer(object):
+    def __init__(self, latency=0.0, error_rate=0.0, payload_size=10, port=0):
+        """
+        serves on 127.0.0.1:port, port 0 picks a free port
+            /single/<address>          one balance per address, like etherchain
+            /multi/<address>           payload_size assets per address, like Counterparty
+            /group/<address>,<address> one balance per address in a grouped call, like blockr
+            /listCoins                 payload_size cryptocurrency tickers, like cryptocoincharts
+            /markets.json              fiat markets, like bitcoincharts
+            /probe/<address>           transaction count of an address, for CHANGE_CHECK probes
+            /tip                       chain tip height, for CHANGE_CHECK tips
+        each request waits latency seconds and fails with status 503 with probability error_rate
+        responses carry an ETag and If-None-Match requests for an unchanged response are answered 304 Not Modified
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.payload_size = payload_size
+        self.request_count = 0
+        self._tickers = None
+        self._lock = Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.base_url = 'http://127.0.0.1:{0}/'.format(self.port)
+
+    def _handler(self):
+        server = self
+
+        class StandInHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with server._lock:
+                    server.request_count += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if random.random() < server.error_rate:
+                    return self._reply(503, b'')
+                body = server.response(self.path)
+                if body is None:
+                    return self._reply(404, b'')
+                payload = json.dumps(body).encode()
+                etag = '"{0}"'.format(hashlib.md5(payload).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    return self._reply(304, b'', etag)
+                self._reply(200, payload, etag)
+
+            def _reply(self, status, payload, etag=None):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                if etag:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return StandInHandler
+
+    def response(self, path):
+        """
+        returns the json body for path or None if path is unknown
+        """
+        if path.startswith('/single/'):
+            return {'data': [{'address': path[8:], 'balance': 2000000000000000000}]}
+        if path.startswith('/multi/'):
+            return {'data': [{'asset': 'ASSET{0}'.format(i), 'balance': str(i + 1)} for i in range(self.payload_size)]}
+        if path.startswith('/group/'):
+            return {'data': [{'address': addr, 'balance': 1.5} for addr in path[7:].split(',') if addr]}
+        if path == '/listCoins':
+            # built once, a large feed would otherwise cost more to build than to parse on the client
+            if self._tickers is None:
+                self._tickers = [{'id': 'asset{0}'.format(i), 'name': 'Asset {0}'.format(i), 'price_btc': '0.0001',
+                                  'volume_btc': '{0}.5'.format(i), 'website': 'https://asset{0}.example'.format(i)}
+                                 for i in range(self.payload_size)]
+                self._tickers += [{'id': 'btc', 'name': 'Bitcoin', 'price_btc': '1'},
+                                  {'id': 'eth', 'name': 'Ethereum', 'price_btc': '0.05'}]
+            return self._tickers
+        if path == '/markets.json':
+            return [{'currency': 'USD', 'bid': 20000}, {'currency': 'EUR', 'bid': 18000}]
+        if path.startswith('/probe/'):
+            return {'data': {'address': path[7:], 'tx_count': 1}}
+        if path == '/tip':
+            return {'height': 800000}
+        return None
+
+    def address_config(self, group_size=15):
+        """
+        returns an address config with one family per stand-in address api
+        """
+        family_template = {'ID_KEY': ['address'], 'DATA_KEY': ['data'], 'BALANCE_KEY': ['balance'],
+                           'MULTI_ASSET_FLAG': False, 'MULTI_REQUEST_FLAG_MAX': [False, 0], 'MULTIPLIER': 1,
+                           'MAX_CONCURRENCY': 8, 'CACHE_TTL': 0, 'RATE_LIMIT': [None, 1], 'TIMEOUT': 10, 'RETRIES': 3}
+        return {'SINGLE': dict(family_template, API=self.base_url + 'single/', MULTIPLIER=0.000000000000000001),
+                'MULTI': dict(family_template, API=self.base_url + 'multi/', ID_KEY=['asset'], MULTI_ASSET_FLAG=True),
+                'GROUP': dict(family_template, API=self.base_url + 'group/', MULTI_REQUEST_FLAG_MAX=[True, group_size],
+                              MAX_BATCH_SIZE=group_size * 4)}
+
+    def price_config(self, hedge_delay=2, mode='hedged'):
+        """
+        returns a price provider config with the stand-in price feeds as the only provider of each asset class
+        """
+        return {'CRYPTOCURRENCY': {'MODE': mode, 'HEDGE_DELAY': hedge_delay,
+                                   'PROVIDERS': [{'NAME': 'standin-{0}'.format(self.port), 'API': self.base_url,
+                                                  'PATH': 'listCoins', 'SYMBOL_KEY': ['id'], 'NAME_KEY': ['name'],
+                                                  'PRICE_KEY': ['price_btc']}]},
+                'FIAT': {'MODE': mode, 'HEDGE_DELAY': hedge_delay,
+                         'PROVIDERS': [{'NAME': 'standin-{0}'.format(self.port), 'API': self.base_url,
+                                        'PATH': 'markets.json', 'SYMBOL_KEY': ['currency'], 'PRICE_KEY': ['bid']}]}}
+
+    def start(self):
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,28 +1,123 @@
 """Crypto-Balances
 
 Usage:
+  run.py address --import <file>
+  run.py shard <index> <count> <dir> [--threaded]
+  run.py history [(base <currency> [--precision <n>])] [--asset <name>] [--from <time>] [--to <time>]
+         [--every <seconds>] [--format <format>]
+  run.py merge <dir> [(base <currency> [--precision <n>])] [--minimum <balance>] [--itemize]
+         [--format <format>] [--refresh-prices]
+  run.py daemon [--port <port>] [--price-interval <seconds>] [--address-interval <seconds>]
+         [(base <currency>)] [--minimum <balance>] [--threaded] [--profile <file>]
   run.py [(address [(--add|--remove) <address_type> <address>...])]
          [(exclusion [(--add|--remove) <asset>...])]
-         [base <currency> [--precision <n>]]
-         [-m --minimum <balance>]
-         [-i --itemize]
+         [(base <currency> [--precision <n>])]
+         [--minimum <balance>]
+         [--itemize]
+         [--threaded]
+         [--refresh-prices] [--stream] [--format <format>] [--profile <file>] [--shards <n>]
+         [--deadline <time>] [--record <file> | --replay <file>]
 
 Options:
   -h --help              Show this screen
   -v --version           Show version
   -a --add
   -r --remove
+  --import <file>        Add address_type,address rows from a csv file, - reads stdin
   -i --itemize           Show asset balance for individual addresses
-  -b --base <currency>   Asset value base denomination
+  -b --base <currency>   Asset value base denomination, comma separated for several e.g. USD,EUR,BTC
   -p --precision <n>     Base currency decimal places
   -m --minimum <balance> Threshold asset balance for print
+  -t --threaded          Use one thread per request instead of the pooled fetch engine
+  --refresh-prices       Fetch current prices instead of using the local price snapshot
+  -s --stream            Print balances as responses arrive instead of after every request has finished
+  -f --format <format>   Output format, table, jsonl or csv [default: table]
+  --port <port>          Loopback port the daemon answers queries on
+  --price-interval <seconds>    Seconds between daemon price refreshes
+  --address-interval <seconds>  Seconds between daemon address refreshes
+  --profile <file>       Write request latencies, bytes received and stage timings to file as a Chrome trace
+  --shards <n>           Split addresses across n worker processes and merge their results
+  --asset <name>         Asset whose balance, price and value history is shown instead of the total value
+  --from <time>          Start of the history range, unix seconds or an ISO 8601 UTC date and time
+  --to <time>            End of the history range, exclusive
+  --every <seconds>      Downsample history to the last snapshot in each interval of this many seconds
+  --deadline <time>      Finish the run within this time e.g. 5s or 500ms, showing the last known balances of
+                         addresses whose requests did not complete in time
+  --record <file>        Write every api response of the run to a compressed archive
+  --replay <file>        Recompute the run from an archive written by --record without any network access
 """
+import sys
+import time
+import shutil
+import tempfile
 from docopt import docopt
-from src import config, util, portfolio
+from src import config, util
+
+def report_failed_addresses(P):
+    for addr_type, addr_lst in P.failed_addresses.items():
+        stale_count = len(P.stale_addresses.get(addr_type, {}))
+        if stale_count:
+            print('Balances stale for {0} {1} addresses, showing their last known balances'.format(stale_count,
+                                                                                               addr_type),
+                  file=sys.stderr)
+        if len(addr_lst) > stale_count:
+            print('Balances missing for {0} {1} addresses, their requests failed or ran out of time'.format(
+                    len(addr_lst) - stale_count, addr_type), file=sys.stderr)
+
+def report_saved_requests(P):
+    merged_count = sum(P.merged_addresses.values())
+    if merged_count or P.shared_requests:
+        print('Merged {0} duplicate addresses and shared {1} identical requests'.format(merged_count,
+                                                                                     P.shared_requests),
+              file=sys.stderr)
+
+def record_history(P):
+    """
+    appends the asset totals, prices and values of the run to the history store, a failure to record them is
+    reported without failing the run whose output has already been shown
+    """
+    from src import history
+    try:
+        history.HistoryStore(config.history_dir).append(history.snapshot_rows(P))
+    except Exception as e:
+        print('Error occurred while recording history', e.args, file=sys.stderr)
 
 def main(argv):
+    archive_file = argv['--record'] or argv['--replay']
+    if archive_file:
+        from src import archive
+        try:
+            archive.active = archive.ResponseArchive(archive_file, 'record' if argv['--record'] else 'replay')
+        except (OSError, ValueError, EOFError) as e:
+            print('Cannot open archive {0}: {1}'.format(archive_file, e), file=sys.stderr)
+            return
+        try:
+            return profiled_run(argv)
+        finally:
+            A, archive.active = archive.active, None
+            A.close()
+            if A.mode == 'record':
+                print('{0} responses recorded to {1}'.format(A.count, archive_file), file=sys.stderr)
+    return profiled_run(argv)
+
+def profiled_run(argv):
+    if argv['--profile']:
+        from src import profiler
+        profiler.default_profiler.enable()
+        try:
+            return run(argv)
+        finally:
+            profiler.default_profiler.write(argv['--profile'])
+            print('Profile written to {0}'.format(argv['--profile']), file=sys.stderr)
+    return run(argv)
+
+def run(argv):
+    run_start = time.monotonic()
     config_manip = [argv['--add'], argv['--remove']]
     if argv['address']:
+        if argv['--import']:
+            config.import_addresses(argv['--import'])
+            return
         if argv['--add']:
             config.add_address(argv['<address_type>'], argv['<address>'])
         if argv['--remove']:
@@ -36,25 +131,137 @@ def main(argv):
             config.remove_exclusion(argv['<asset>'])
         if not any(config_manip):
             config.display_exclusions()
+    if argv['address'] or argv['exclusion']:
+        # config commands never touch the network
+        return
+
+    # writers imports decimal, which config commands do not need
+    from src import writers
+
+    output_format = argv['--format'] or 'table'
+    if output_format not in writers.FORMATS:
+        print('Unknown format {0}, use one of {1}'.format(output_format, ', '.join(writers.FORMATS)), file=sys.stderr)
+        return
+    try:
+        deadline_seconds = util.parse_duration(argv['--deadline']) if argv['--deadline'] else None
+    except ValueError:
+        print('Invalid deadline {0}, use a duration such as 5s or 500ms'.format(argv['--deadline']), file=sys.stderr)
+        return
+
+    if argv['history']:
+        from src import history
+        H = history.HistoryStore(config.history_dir)
+        series = H.query(util.currency_list(argv['<currency>'] or 'BTC')[0],
+                         history.parse_time(argv['--from']) if argv['--from'] else None,
+                         history.parse_time(argv['--to']) if argv['--to'] else None,
+                         int(argv['--every']) if argv['--every'] else None,
+                         argv['--asset'].upper() if argv['--asset'] else None)
+        history.write_series(series, util.currency_list(argv['<currency>'] or 'BTC')[0],
+                             argv['--asset'].upper() if argv['--asset'] else None, output_format,
+                             argv['--precision'] or 8)
+        return
+
+    # the network stack and portfolio are only imported once balances are needed
+    from src import portfolio, daemon, pipeline, shard, providers, scheduler, archive
 
-    base_currency = argv['<currency>'] or 'BTC'
+    # archived runs neither use nor update the balance cache and price snapshot, so the archive holds every
+    # response a run needs and a replay leaves no trace
+    A = archive.active
+    if A and argv['--shards']:
+        print('Sharded runs cannot be recorded or replayed', file=sys.stderr)
+        return
+    balance_cache_file = config.balance_cache_file if not A else None
+    price_snapshot_file = config.price_snapshot_file if not A else None
+
+    try:
+        providers.default_registry.configure(config.price_config())
+    except (KeyError, ValueError) as e:
+        print('Invalid price provider settings in {0}: {1}'.format(config.price_config_file, e), file=sys.stderr)
+        return
+
+    base_currencies = util.currency_list(argv['<currency>'] or 'BTC')
     base_precision = argv['--precision'] or 8
     min_balance = argv['--minimum'] or 0
 
-    addr_data = util.json_from_file(config.addr_data_file)
-    addr_config = util.json_from_file(config.addr_config_file)
-    excluded_assets = util.list_from_file(config.excluded_assets_file)
+    store = config.open_address_store()
+    addr_config = util.json_from_file(config.app_file(config.addr_config_file))
+    excluded_assets = util.list_from_file(config.app_file(config.excluded_assets_file))
+
+    if argv['shard']:
+        partial_file = shard.evaluate_shard(store.addr_data(), addr_config, int(argv['<index>']), int(argv['<count>']),
+                                            argv['<dir>'], argv['--threaded'], config.balance_cache_file)
+        store.close()
+        print('Partial result written to {0}'.format(partial_file))
+        return
+
+    # the deadline is shared out between fetching balances, fetching prices and rendering
+    deadline = scheduler.RunDeadline(deadline_seconds, run_start) if deadline_seconds is not None else None
+    if deadline:
+        deadline.enter('prices' if argv['--stream'] else 'fetch')
+
+    sharded = argv['merge'] or argv['--shards']
+    P = portfolio.Portfolio(store.addr_data(), addr_config, excluded_assets, argv['--threaded'],
+                            balance_cache_file, refresh=not (argv['--stream'] or sharded))
+    if sharded:
+        out_dir = argv['<dir>'] or tempfile.mkdtemp()
+        if argv['--shards']:
+            shard.evaluate_sharded(store.addr_data(), addr_config, int(argv['--shards']), out_dir,
+                                   argv['--threaded'], config.balance_cache_file)
+        try:
+            shard.merge_partials(P, shard.load_partials(out_dir))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return
+        finally:
+            if not argv['<dir>']:
+                shutil.rmtree(out_dir)
+        if balance_cache_file:
+            shard.merge_caches(balance_cache_file, store.addr_data())
+    store.close()
+
+    if argv['daemon']:
+        D = daemon.PortfolioDaemon(P, base_currencies, min_balance,
+                                   argv['--price-interval'] or daemon.DEFAULT_PRICE_INTERVAL,
+                                   argv['--address-interval'] or daemon.DEFAULT_ADDRESS_INTERVAL,
+                                   config.price_snapshot_file, config.history_dir)
+        D.serve(argv['--port'] or daemon.DEFAULT_PORT)
+        return
+
+    if argv['--stream'] and not sharded:
+        if P.isempty():
+            print('No addresses have been added')
+            return
+        pipeline.stream_balances(P, base_currencies, min_balance, 8, base_precision, argv['--itemize'],
+                                 price_snapshot_file, argv['--refresh-prices'], output_format)
+        report_failed_addresses(P)
+        report_saved_requests(P)
+        if not (A and A.mode == 'replay'):
+            record_history(P)
+        return
 
-    P = portfolio.Portfolio(addr_data, addr_config, excluded_assets)
     P.filter_addr_assets(min_balance)
-    P.retrieve_asset_prices(base_currency)
+    if deadline:
+        deadline.enter('prices')
+    P.retrieve_asset_prices(base_currencies, price_snapshot_file, argv['--refresh-prices'])
+    if deadline:
+        deadline.enter('render')
+
+    report_failed_addresses(P)
+    report_saved_requests(P)
 
     if P.isempty():
         print('No addresses have been added')
+    elif output_format != 'table' and argv['--itemize']:
+        P.write_address_balances(output_format, 8, base_precision)
+    elif output_format != 'table':
+        P.write_total_balances(output_format, 8, base_precision)
     elif argv['--itemize']:
         P.print_address_balances(8, base_precision)
     else:
         P.print_total_balances(8, base_precision)
+    # replays recompute a past run, which does not belong in the history of the current portfolio
+    if not P.isempty() and not (A and A.mode == 'replay'):
+        record_history(P)
 
 if __name__ == '__main__':
     args = docopt(__doc__, version='Crypto-Balances v1.0.0')
@@ -0,0 +1,107 @@
+import gzip
+import json
+from threading import Lock
+
+MODES = ['record', 'replay']
+# response headers kept in the archive, the ones conditional requests send back
+ARCHIVED_HEADERS = ['ETag', 'Last-Modified']
+
+class ArchiveMiss(Exception):
+    pass
+
+class ArchivedResponse(object):
+    def __init__(self, status_code, headers, content, encoding=None):
+        """
+        stands in for the requests.Response of a recorded api call, with the whole body held in content
+        """
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_content(self, chunk_size=1):
+        return (self.content[i:i + chunk_size] for i in range(0, len(self.content), chunk_size))
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8')
+
+class ResponseArchive(object):
+    def __init__(self, file_path, mode='replay'):
+        """
+        gzip compressed archive at file_path of every api response of a run, each response being a json header line
+        {'url', 'status', 'encoding', 'headers', 'size'} followed by size bytes of body
+        in 'record' mode responses are appended as they arrive, in 'replay' mode the recorded responses of each
+        url answer its requests in the order they were recorded, the last one answering any further requests
+        """
+        if mode not in MODES:
+            raise ValueError('Unknown archive mode {0}, expected one of {1}'.format(mode, ', '.join(MODES)))
+        self.file_path = file_path
+        self.mode = mode
+        # {url:[ArchivedResponse, ], } of the responses not yet replayed
+        self.responses = {}
+        self.count = 0
+        self._lock = Lock()
+        self._file = gzip.open(file_path, 'wb') if mode == 'record' else None
+        if mode == 'replay':
+            self._load()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self):
+        """
+        reads every response of the archive into self.responses, a response cut short by an interrupted
+        recording ends the archive
+        """
+        with gzip.open(self.file_path, 'rb') as f:
+            try:
+                for header_line in iter(f.readline, b''):
+                    header = json.loads(header_line)
+                    content = f.read(header['size'])
+                    if len(content) < header['size']:
+                        break
+                    self.responses.setdefault(header['url'], []).append(
+                            ArchivedResponse(header['status'], header['headers'], content, header['encoding']))
+                    self.count += 1
+            except EOFError:
+                pass
+
+    def record(self, url, raw_resp):
+        """
+        appends the status, archived headers and body of raw_resp, the requests.Response for url, to the archive
+        """
+        content = raw_resp.content
+        header = {'url': url,
+                  'status': raw_resp.status_code,
+                  'encoding': raw_resp.encoding,
+                  'headers': {name: raw_resp.headers[name] for name in ARCHIVED_HEADERS if name in raw_resp.headers},
+                  'size': len(content)}
+        with self._lock:
+            # responses arriving after the run has finished, such as those of losing hedged requests, are dropped
+            if self._file is not None:
+                self._file.write(json.dumps(header).encode() + b'\n')
+                self._file.write(content)
+                self.count += 1
+
+    def response(self, url):
+        """
+        returns the next recorded ArchivedResponse for url, raises ArchiveMiss if url was never recorded
+        """
+        with self._lock:
+            url_responses = self.responses.get(url)
+            if not url_responses:
+                raise ArchiveMiss('{0} is not in archive {1}'.format(url, self.file_path))
+            return url_responses.pop(0) if len(url_responses) > 1 else url_responses[0]
+
+# archive every api call of the run is recorded to or replayed from, None for live runs
+active = None
@@ -1,8 +1,13 @@
-from src import util
-from queue import Queue
+import os
+import time
+import pickle
+from src import profiler, providers
 from threading import Thread
 from decimal import Decimal
 
+# seconds before a price snapshot is refreshed in the background
+PRICE_MAX_AGE = 300
+
 class Asset(object):
     def __init__(self, balance):
         self.balance = Decimal(balance)
@@ -10,59 +15,154 @@ class Asset(object):
         self.value = 0
 
 class Prices(object):
-    def __init__(self):
+    def __init__(self, snapshot_file=None, max_age=PRICE_MAX_AGE, refresh=False, assets=None, registry=None):
         """
         retrieves cryptocurrency and fiat prices denominated in BTC and separated them into approprate
         dictionaries for fast lookup when Prices.get() is called
+        prices are fetched from the providers of registry, providers.default_registry unless given
+        if snapshot_file is provided prices are loaded from that local snapshot when it exists, and a snapshot
+        older than max_age seconds is used as is while a fresh one is fetched in the background for the next run
+        refresh skips the snapshot and always fetches current prices, the snapshot prices of an asset class are
+        still used if none of its providers answer
+        if assets, a collection of currency symbols or names, is provided only cryptocurrency tickers of those
+        assets are kept, every cryptocurrency ticker is kept otherwise, and any snapshot is used as is, keeping to
+        the assets it holds when it is refreshed
         """
         self.cryptocurrency_ticker_symbols = {}
         self.cryptocurrency_ticker_names = {}
         self.fiat_ticker_symbols = {}
+        # {base_currency:{currency:price, }, } built on first use of each base currency
+        self.rate_tables = {}
+        self.snapshot_file = snapshot_file
+        self.refresh_thread = None
+        self.assets = None if assets is None else {asset_name.upper() for asset_name in assets}
+        self.registry = registry or providers.default_registry
+
+        snapshot = self._load_snapshot() if snapshot_file else None
+        if snapshot is not None:
+            # provider latencies measured by earlier runs rank the providers of this one
+            self.registry.load_stats(snapshot.get('providers', {}))
+        if refresh or not self._covers(snapshot):
+            tickers = self._fetch_tickers()
+            if snapshot_file:
+                self._save_snapshot(tickers)
+            if snapshot is not None:
+                tickers = [kept if fetched is None else fetched for fetched, kept in zip(tickers, snapshot['tickers'])]
+            self._update(tickers)
+        else:
+            if self.assets is None and snapshot.get('assets') is not None:
+                self.assets = set(snapshot['assets'])
+            self._update(snapshot['tickers'])
+            if time.time() - snapshot['time'] > max_age:
+                # a refresh still running when the run ends must not keep the process alive, the snapshot is only
+                # replaced once it is fully written so an interrupted refresh leaves the old one in place
+                self.refresh_thread = Thread(target=self._refresh_snapshot, daemon=True)
+                self.refresh_thread.start()
+
+    def _covers(self, snapshot):
+        """
+        returns True if snapshot holds the tickers of every asset of self.assets, or if self.assets is None
+        a snapshot which skipped tickers is only used if it kept every ticker wanted now
+        """
+        if snapshot is None:
+            return False
+        snapshot_assets = snapshot.get('assets')
+        return snapshot_assets is None or self.assets is None or self.assets <= set(snapshot_assets)
+
+    def covers(self, assets):
+        """
+        returns True if the tickers in use hold the prices of every asset of assets
+        """
+        return self.assets is None or {asset_name.upper() for asset_name in assets} <= self.assets
+
+    @profiler.default_profiler.timed()
+    def _fetch_tickers(self):
+        """
+        returns (cryptocurrency_ticker_symbols, cryptocurrency_ticker_names, fiat_ticker_symbols) from the price
+        providers, asking for the cryptocurrency and fiat asset classes at the same time and keeping only the
+        cryptocurrency tickers of self.assets if it is not None
+        the tickers of an asset class none of whose providers answered are None
+        """
+        results = {}
 
-        q = Queue()
-        threads = [Thread(target=util.api_call, args=('http://api.cryptocoincharts.info/', 'listCoins', q)),
-                   Thread(target=util.api_call, args=('http://api.bitcoincharts.com/v1/', 'markets.json', q))]
+        def fetch(asset_class, assets):
+            results[asset_class] = self.registry.fetch(asset_class, assets)
+
+        threads = [Thread(target=fetch, args=('CRYPTOCURRENCY', self.assets)), Thread(target=fetch, args=('FIAT', None))]
         [t.start() for t in threads]
         [t.join() for t in threads]
+        crypto_symbols, crypto_names = results['CRYPTOCURRENCY'] or (None, None)
+        fiat_symbols = results['FIAT'][0] if results['FIAT'] else None
+        return crypto_symbols, crypto_names, fiat_symbols
 
-        while not q.empty():
-            url_path, ticker_data = q.get()
-            if url_path == 'listCoins':
-                for ticker in ticker_data:
-                    btc_price = Decimal(ticker['price_btc'])
-                    if btc_price > 0:
-                        self.cryptocurrency_ticker_symbols[ticker['id'].upper()] = btc_price
-                        self.cryptocurrency_ticker_names[ticker['name'].upper()] = btc_price
-            elif url_path == 'markets.json':
-                for ticker in ticker_data:
-                    btc_price = ticker['bid']
-                    if btc_price:
-                        self.fiat_ticker_symbols[ticker['currency']] = Decimal(btc_price)
+    @profiler.default_profiler.timed()
+    def _load_snapshot(self):
+        """
+        returns {'time':fetch_time, 'tickers':(...), 'assets':[asset, ], 'providers':{...}} from self.snapshot_file
+        or None if it is missing or unreadable, assets is None when the snapshot kept every ticker and providers
+        holds the provider latencies of ProviderRegistry.stats()
+        """
+        try:
+            with open(self.snapshot_file, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+            return None
+
+    def _refresh_snapshot(self):
+        """
+        fetches current prices into self.snapshot_file without changing the prices already in use
+        """
+        self._save_snapshot(self._fetch_tickers())
+
+    def _save_snapshot(self, tickers):
+        """
+        atomically writes tickers to self.snapshot_file, tickers missing an asset class no provider answered are
+        not saved
+        """
+        if any(class_tickers is None for class_tickers in tickers):
+            return
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'time': time.time(), 'tickers': tickers,
+                         'assets': None if self.assets is None else sorted(self.assets),
+                         'providers': self.registry.stats()}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.snapshot_file)
+
+    def _tickers(self):
+        return self.cryptocurrency_ticker_symbols, self.cryptocurrency_ticker_names, self.fiat_ticker_symbols
+
+    def _update(self, tickers):
+        crypto_symbols, crypto_names, fiat_symbols = tickers
+        self.cryptocurrency_ticker_symbols.update(crypto_symbols or {})
+        self.cryptocurrency_ticker_names.update(crypto_names or {})
+        self.fiat_ticker_symbols.update(fiat_symbols or {})
+        self.rate_tables = {}
 
     def get(self, target_currency, base_currency):
         """
         returns the current price of target_currency denominated in base_currency
         """
-        def currency_to_btc(currency):
-            if currency in self.cryptocurrency_ticker_symbols:
-                return self.cryptocurrency_ticker_symbols[currency]
-            elif currency in self.fiat_ticker_symbols:
-                return self.fiat_ticker_symbols[currency]
-            elif currency in self.cryptocurrency_ticker_names:
-                return self.cryptocurrency_ticker_names[currency]
-            else:
-                return Decimal(0)
-
-        target, base = target_currency.upper(), base_currency.upper()
-        target_price = currency_to_btc(target)
-        base_price = currency_to_btc(base)
+        return self.rate_table(base_currency).get(target_currency.upper(), Decimal(0))
 
-        if all([target_price, base_price]):
-            if base != 'BTC':
-                if base in self.cryptocurrency_ticker_symbols or base in self.cryptocurrency_ticker_names:
-                    target_price /= base_price
-                else:
-                    target_price *= base_price
-            return target_price
-        return Decimal(0)
+    def rate_table(self, base_currency):
+        """
+        returns {currency:price} denominated in base_currency for every known currency, built once per base_currency
+        ticker symbols take precedence over fiat symbols which take precedence over cryptocurrency names
+        """
+        base = base_currency.upper()
+        if base not in self.rate_tables:
+            btc_prices = dict(self.cryptocurrency_ticker_names)
+            btc_prices.update(self.fiat_ticker_symbols)
+            btc_prices.update(self.cryptocurrency_ticker_symbols)
 
+            base_price = btc_prices.get(base, 0)
+            if not base_price:
+                rates = {}
+            elif base == 'BTC':
+                rates = btc_prices
+            elif base in self.cryptocurrency_ticker_symbols or base in self.cryptocurrency_ticker_names:
+                rates = {currency: btc_price / base_price for currency, btc_price in btc_prices.items()}
+            else:
+                rates = {currency: btc_price * base_price for currency, btc_price in btc_prices.items()}
+            self.rate_tables[base] = rates
+        return self.rate_tables[base]
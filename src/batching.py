@@ -0,0 +1,33 @@
+# seconds a grouped request may take before the batch size stops growing
+TARGET_LATENCY = 2.0
+
+class AdaptiveBatcher(object):
+    def __init__(self, initial, minimum=1, maximum=None, target_latency=TARGET_LATENCY):
+        """
+        additive increase / multiplicative decrease of the number of addresses grouped into one api call,
+        grows by one address while calls succeed under target_latency and halves on failed calls
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.size = min(self.maximum, max(self.minimum, initial))
+        self.target_latency = target_latency
+
+    def next_chunks(self, pending, chunk_count):
+        """
+        pops up to chunk_count lists of at most self.size addresses from the left of deque pending
+        """
+        chunks = []
+        while pending and len(chunks) < chunk_count:
+            chunks.append([pending.popleft() for _ in range(min(self.size, len(pending)))])
+        return chunks
+
+    def record(self, latency, failed):
+        """
+        adjusts self.size after a round of grouped calls which took latency seconds, failed is true if any call failed
+        """
+        if failed:
+            self.size = max(self.minimum, self.size // 2)
+        elif latency > self.target_latency * 2:
+            self.size = max(self.minimum, (self.size * 3) // 4)
+        elif latency < self.target_latency:
+            self.size = min(self.maximum, self.size + 1)
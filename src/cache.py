@@ -0,0 +1,106 @@
+import os
+import time
+from decimal import Decimal
+
+from src import util
+
+class BalanceCache(object):
+    def __init__(self, file_path):
+        """
+        persistent {family:{address:{'time':fetch_time, 'assets':{asset_name:balance, }, 'marker':marker}, }, } store
+        of the last fetched balances, kept as json next to the address file or only in memory if file_path is None
+        marker is whatever the change check of the family compares against to tell if the balances are still current
+        """
+        self.file_path = file_path
+        self.entries = {}
+        if file_path and os.path.isfile(file_path) and os.stat(file_path).st_size > 0:
+            try:
+                self.entries = util.json_from_file(file_path)
+            except ValueError:
+                # corrupt cache is treated as empty and rewritten on save()
+                self.entries = {}
+
+    def get(self, family, addr, ttl, now=None):
+        """
+        returns {asset_name:Decimal(balance), } cached for addr of family if it is younger than ttl seconds
+        otherwise returns None
+        """
+        entry = self.entries.get(family, {}).get(addr)
+        if entry is None:
+            return None
+        now = now or time.time()
+        if now - entry['time'] >= ttl:
+            return None
+        return {asset_name: Decimal(balance) for asset_name, balance in entry['assets'].items()}
+
+    def has(self, family, addr):
+        """
+        returns true if balances were ever cached for addr of family
+        """
+        return addr in self.entries.get(family, {})
+
+    def last_known(self, family, addr):
+        """
+        returns (fetch_time, {asset_name:Decimal(balance), }) last cached for addr of family however old it is,
+        or None if nothing was ever cached for it
+        """
+        entry = self.entries.get(family, {}).get(addr)
+        if entry is None:
+            return None
+        return entry['time'], {asset_name: Decimal(balance) for asset_name, balance in entry['assets'].items()}
+
+    def marker(self, family, addr):
+        """
+        returns the change check marker stored with the cached balances of addr of family, or None
+        """
+        return self.entries.get(family, {}).get(addr, {}).get('marker')
+
+    def put(self, family, addr, assets, now=None, marker=None):
+        """
+        stores {asset_name:balance, } for addr of family, along with its change check marker if there is one
+        """
+        entry = {'time': now or time.time(),
+                 'assets': {asset_name: str(balance) for asset_name, balance in assets.items()}}
+        if marker is not None:
+            entry['marker'] = marker
+        self.entries.setdefault(family, {})[addr] = entry
+
+    def evict(self, family_addrs):
+        """
+        removes cached entries for any family or address not present in {family:[address, ], }
+        """
+        for family in list(self.entries):
+            if family not in family_addrs:
+                del self.entries[family]
+                continue
+            keep = set(family_addrs[family])
+            for addr in list(self.entries[family]):
+                if addr not in keep:
+                    del self.entries[family][addr]
+
+    def merge(self, entries):
+        """
+        adds entries of another cache, {family:{address:entry, }, }, keeping the most recently fetched entry of
+        addresses held by both
+        """
+        for family, addr_entries in entries.items():
+            fam_entries = self.entries.setdefault(family, {})
+            for addr, entry in addr_entries.items():
+                if addr not in fam_entries or entry['time'] > fam_entries[addr]['time']:
+                    fam_entries[addr] = entry
+
+    def save(self):
+        """
+        writes the cache to self.file_path
+        """
+        if self.file_path:
+            util.json_to_file(self.file_path, self.entries)
+
+    def touch(self, family, addr, now=None):
+        """
+        marks the cached balances of addr of family as current without changing them, once a change check has
+        found them unchanged
+        """
+        entry = self.entries.get(family, {}).get(addr)
+        if entry is not None:
+            entry['time'] = now or time.time()
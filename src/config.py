@@ -1,56 +1,61 @@
 import os
+import csv
+import sys
 
 from src import util
+from src.store import AddressStore
 
 dir_path = str(os.path.realpath(__file__)).rsplit('/', 1)[0]
 addr_data_file = dir_path + '/addresses.json'
+addr_db_file = dir_path + '/addresses.db'
 addr_config_file = dir_path + '/address_config.json'
 excluded_assets_file = dir_path + '/exclusions.txt'
+balance_cache_file = dir_path + '/balance_cache.json'
+price_snapshot_file = dir_path + '/prices.snapshot'
+price_config_file = dir_path + '/price_config.json'
+history_dir = dir_path + '/history'
 
-app_file_paths = [addr_data_file, addr_config_file, excluded_assets_file]
-
-for file_path in app_file_paths:
-    file_name, file_extension = os.path.splitext(file_path)
-    if not os.path.isfile(file_path) or os.stat(file_path).st_size == 0:
-        with open(file_path, 'w') as f:
-            if file_extension == '.json':
-                # write empty dict to files designated as json if they must be created
-                f.write('{}')
-            else:
-                pass
-    #print('{0} ok'.format(file_path))
+# app files checked so far, files are only created when first used rather than when config is imported
+_checked_file_paths = set()
 
 def add_address(addr_type, addr_lst=[]):
     """
     updates addresses from file to include new addresses of addr_type after verifying the address as valid
     """
     addr_type = addr_type.upper()
-    type_data = util.json_from_file(addr_config_file)
-    addr_data = util.json_from_file(addr_data_file)
+    store = open_address_store()
+    _ensure_address_type(addr_type)
+    store.add(addr_type, addr_lst)
+    store.close()
 
-    if addr_type in addr_data:
-        [addr_data[addr_type].append(addr) for addr in addr_lst]
-
-    else:
-        # settings template for new address type
-        type_data[addr_type] = {'API':'',
-                                'DATA_KEY':[''],
-                                'ID_KEY':[''],
-                                'BALANCE_KEY':[''],
-                                'MULTI_ASSET_FLAG':False,
-                                'MULTI_REQUEST_FLAG_MAX':[False, 0],
-                                'MULTIPLIER':1}
-        addr_data[addr_type] = [addr for addr in addr_lst]
-        util.json_to_file(addr_config_file, type_data)
-        print('Update address type params for {0} addresses at\n{1}'.format(addr_type, addr_config_file))
-
-    util.json_to_file(addr_data_file, addr_data)
+def _ensure_address_type(addr_type):
+    """
+    adds a settings template for addr_type to the address config file if it is a new address type
+    """
+    type_data = util.json_from_file(app_file(addr_config_file))
+    if addr_type in type_data:
+        return
+    # settings template for new address type
+    type_data[addr_type] = {'API':'',
+                            'DATA_KEY':[''],
+                            'ID_KEY':[''],
+                            'BALANCE_KEY':[''],
+                            'MULTI_ASSET_FLAG':False,
+                            'MULTI_REQUEST_FLAG_MAX':[False, 0],
+                            'MULTIPLIER':1,
+                            'MAX_CONCURRENCY':8,
+                            'CACHE_TTL':300,
+                            'RATE_LIMIT':[None, 1],
+                            'TIMEOUT':10,
+                            'RETRIES':3}
+    util.json_to_file(addr_config_file, type_data)
+    print('Update address type params for {0} addresses at\n{1}'.format(addr_type, addr_config_file))
 
 def add_exclusion(asset_lst=[]):
     """
     Adds each asset in asset_lst to current exclusions
     """
-    exlusion_lst = [i.upper() for i in util.list_from_file(excluded_assets_file)]
+    exlusion_lst = [i.upper() for i in util.list_from_file(app_file(excluded_assets_file))]
     for asset in asset_lst:
         asset = asset.upper()
         if asset not in exlusion_lst:
@@ -58,39 +63,83 @@ def add_exclusion(asset_lst=[]):
     with open(excluded_assets_file, 'w') as f:
         [f.write(e + '\n') for e in exlusion_lst]
 
+def app_file(file_path):
+    """
+    Returns file_path after creating it if it is missing or empty, json files are created holding an empty dict
+    """
+    if file_path in _checked_file_paths:
+        return file_path
+    file_name, file_extension = os.path.splitext(file_path)
+    if not os.path.isfile(file_path) or os.stat(file_path).st_size == 0:
+        with open(file_path, 'w') as f:
+            if file_extension == '.json':
+                # write empty dict to files designated as json if they must be created
+                f.write('{}')
+    _checked_file_paths.add(file_path)
+    return file_path
+
 def display_addresses():
     """
     Prints all assets for each address
     """
-    addr_data = util.json_from_file(addr_data_file)
-    for addr_type, addr_lst in addr_data.items():
+    store = open_address_store()
+    for addr_type, addr_lst in store.addr_data().items():
         print(addr_type)
         [print('   {0}'.format(addr)) for addr in addr_lst]
+    store.close()
 
 def display_exclusions():
     """
     Prints all excluded assets
     """
-    exclusion_lst = util.list_from_file(excluded_assets_file)
+    exclusion_lst = util.list_from_file(app_file(excluded_assets_file))
     [print('   {0}'.format(e)) for e in exclusion_lst]
 
+def import_addresses(file_path):
+    """
+    Adds every address_type,address row of csv file at file_path, or stdin if file_path is -, in a single transaction
+    """
+    store = open_address_store()
+    with (sys.stdin if file_path == '-' else open(file_path, newline='')) as f:
+        rows = [(row[0].strip().upper(), row[1]) for row in csv.reader(f) if len(row) >= 2]
+    # a header row such as address_type,address is skipped
+    if rows and rows[0][0] in ('TYPE', 'FAMILY', 'ADDRESS_TYPE'):
+        rows = rows[1:]
+    [_ensure_address_type(addr_type) for addr_type in sorted({addr_type for addr_type, addr in rows})]
+    added = store.bulk_import(rows)
+    store.close()
+    print('Imported {0} new addresses, {1} duplicates ignored'.format(added, len(rows) - added))
+
+def open_address_store():
+    """
+    Returns the AddressStore at addr_db_file, created from the legacy addresses.json file if it does not exist yet
+    """
+    return AddressStore(addr_db_file, addr_data_file)
+
+def price_config():
+    """
+    Returns the price provider settings of price_config_file, or an empty dict keeping the default providers
+    if the file does not exist
+    """
+    return util.json_from_file(price_config_file) if os.path.isfile(price_config_file) else {}
+
 def remove_address(addr_type, addr_lst=[]):
     """
     updates addresses from file so addresses in rm_addr_lst are removed if they are present
     """
     addr_type = addr_type.upper()
-    addr_data = util.json_from_file(addr_data_file)
-    if addr_type not in addr_data:
+    store = open_address_store()
+    if not store.has_family(addr_type):
         print('No addresses with type {0} found'.format(addr_type))
-        return
-    addr_data[addr_type] = [addr for addr in addr_data[addr_type] if addr not in addr_lst]
-    util.json_to_file(addr_data_file, addr_data)
+    else:
+        store.remove(addr_type, addr_lst)
+    store.close()
 
 def remove_exclusion(asset_lst=[]):
     """
     Removes all assets in asset_lst from current exclusions list
     """
     asset_lst = [asset.upper() for asset in asset_lst]
-    old_exclusion_lst = util.list_from_file(excluded_assets_file)
+    old_exclusion_lst = util.list_from_file(app_file(excluded_assets_file))
     new_exclusion_lst = list(set(old_exclusion_lst) - set(asset_lst))
-    util.list_to_file(excluded_assets_file, new_exclusion_lst)
+    util.list_to_file(app_file(excluded_assets_file), new_exclusion_lst)
@@ -0,0 +1,144 @@
+import sys
+import json
+import time
+from threading import Event, Lock, Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src import asset, util, history
+
+DEFAULT_PORT = 8337
+DEFAULT_PRICE_INTERVAL = 300
+DEFAULT_ADDRESS_INTERVAL = 60
+
+class PortfolioDaemon(object):
+    def __init__(self, P, base_currencies, min_balance=0, price_interval=DEFAULT_PRICE_INTERVAL,
+                 address_interval=DEFAULT_ADDRESS_INTERVAL, snapshot_file=None, history_dir=None):
+        """
+        keeps Portfolio P resident, refreshing prices and address balances on separate schedules and serving
+        pre-rendered json for totals, itemized balances and single addresses over a loopback http endpoint
+        if history_dir is provided a snapshot of the totals is appended to the history store there on every refresh
+        """
+        self.P = P
+        self.base_currencies = util.currency_list(base_currencies)
+        self.min_balance = min_balance
+        self.price_interval = float(price_interval)
+        self.address_interval = float(address_interval)
+        self.snapshot_file = snapshot_file
+        self.responses = {}
+        self.stopped = Event()
+        self._lock = Lock()
+        self.server = None
+        self.history = history.HistoryStore(history_dir) if history_dir else None
+
+        self.P.filter_addr_assets(self.min_balance)
+        self.P.retrieve_asset_prices(self.base_currencies, self.snapshot_file)
+        self._render()
+        self._record()
+
+    def _asset_json(self, asset_name, balance):
+        prices = {base_currency: self.P.base_prices[base_currency].get(asset_name, 0)
+                  for base_currency in self.base_currencies}
+        return {'balance': str(balance),
+                'price': {base_currency: str(price) for base_currency, price in prices.items()},
+                'value': {base_currency: str(balance * price) for base_currency, price in prices.items()}}
+
+    def _refresh_addresses(self):
+        """
+        refetches expired address balances and re-renders responses if any holdings changed
+        """
+        changed_addrs = self.P.refresh()
+        with self._lock:
+            if changed_addrs:
+                self.P.filter_addr_assets(self.min_balance)
+                # assets held for the first time are priced now rather than at the next price refresh
+                if not self.P.prices.covers(self.P.unique_assets | set(self.base_currencies)):
+                    self.P.retrieve_asset_prices(self.base_currencies, self.snapshot_file)
+                else:
+                    self.P.apply_prices(self.base_currencies)
+                self._render()
+            self._record()
+
+    def _refresh_prices(self):
+        """
+        fetches current prices and re-renders responses
+        """
+        AP = asset.Prices(self.snapshot_file, refresh=True, assets=self.P.unique_assets | set(self.base_currencies))
+        with self._lock:
+            self.P.prices = AP
+            self.P.apply_prices(self.base_currencies)
+            self._render()
+            self._record()
+
+    def _record(self):
+        """
+        appends the current totals, prices and values to the history store, a failure to record them is reported
+        without stopping the daemon
+        """
+        if self.history is not None:
+            try:
+                self.history.append(history.snapshot_rows(self.P))
+            except Exception as e:
+                print('Error occurred while recording history', e.args, file=sys.stderr)
+
+    def _render(self):
+        """
+        serializes every query response up front so answering a query is a single dict lookup
+        """
+        totals = {asset_name: self._asset_json(asset_name, balance)
+                  for asset_name, balance in self.P.get_asset_totals().items()}
+        balances = {addr: {asset_name: self._asset_json(asset_name, balance)
+                           for asset_name, balance in asset_data.items()}
+                    for addr, asset_data in self.P.address_balances().items()}
+        meta = {'base': self.base_currencies, 'updated': time.time()}
+
+        responses = {'/totals': json.dumps(dict(meta, totals=totals)).encode(),
+                     '/balances': json.dumps(dict(meta, balances=balances)).encode()}
+        for addr, asset_data in balances.items():
+            responses['/address/' + addr] = json.dumps(dict(meta, address=addr, balances=asset_data)).encode()
+        # swapped in one assignment so queries never see a partially rendered set of responses
+        self.responses = responses
+
+    def _schedule(self, interval, task):
+        while not self.stopped.wait(interval):
+            try:
+                task()
+            except Exception as e:
+                print('Error occurred while refreshing', e.args, file=sys.stderr)
+
+    def serve(self, port=DEFAULT_PORT):
+        """
+        starts the refresh schedules and serves queries on 127.0.0.1:port until stop() is called
+        """
+        daemon = self
+
+        class QueryHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = daemon.responses.get(self.path.rstrip('/'))
+                self.send_response(200 if body else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body or b'')))
+                self.end_headers()
+                self.wfile.write(body or b'')
+
+            def log_message(self, *args):
+                pass
+
+        threads = [Thread(target=self._schedule, args=(self.price_interval, self._refresh_prices), daemon=True),
+                   Thread(target=self._schedule, args=(self.address_interval, self._refresh_addresses), daemon=True)]
+        [t.start() for t in threads]
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', int(port)), QueryHandler)
+        print('Serving /totals, /balances and /address/<address> on http://127.0.0.1:{0}'.format(port))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stopped.set()
+            self.server.server_close()
+
+    def stop(self):
+        """
+        stops serving queries and refreshing
+        """
+        self.stopped.set()
+        if self.server:
+            self.server.shutdown()
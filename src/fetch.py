@@ -0,0 +1,162 @@
+from queue import Queue, Empty
+from threading import BoundedSemaphore, Lock, Thread
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src import util, scheduler
+
+DEFAULT_CONCURRENCY = 8
+# worker threads shared by the requests to every host, each fetch keeps at most its limit of them busy
+MAX_WORKERS = 64
+
+class FetchEngine(object):
+    def __init__(self, default_limit=DEFAULT_CONCURRENCY):
+        """
+        fetch engine running requests on a thread pool it keeps for its lifetime, which bounds the number of in
+        flight requests per api host and reuses keep-alive connections from one pooled requests.Session per host,
+        the first limit asked for a host is kept so families sharing an api host share its limit
+        """
+        self.default_limit = default_limit
+        self.sessions = {}
+        # {host:threading.BoundedSemaphore, } of the in flight requests of each host
+        self.host_limits = {}
+        self.executor = None
+        self._lock = Lock()
+
+    def host_limit(self, api_base, limit):
+        """
+        returns the semaphore bounding the in flight requests to the host of api_base, created with limit slots
+        """
+        host = urlsplit(api_base).netloc
+        with self._lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = BoundedSemaphore(limit)
+            return self.host_limits[host]
+
+    def iter_fetch(self, api_base, api_paths, limit=None, validators=None):
+        """
+        yields util.ApiResponse for each api_base + api_path that succeeded as soon as it arrives, with at most
+        limit requests to the api_base host in flight at once
+        if validators {api_path:validators, } is provided every request is a util.conditional_api_call() and
+        util.ConditionalResponse is yielded instead, including paths which were not modified
+        once the deadline scheduler.default_scheduler had when the first response was asked for passes, requests
+        still waiting to start are dropped and no more responses are waited for, later stages of a run moving
+        the deadline on do not revive them
+        """
+        api_paths = list(api_paths)
+        if not api_paths:
+            return
+        limit = max(1, int(limit or self.default_limit))
+        deadline = scheduler.default_scheduler.deadline
+        session = self.session(api_base, limit)
+        host_limit = self.host_limit(api_base, limit)
+        executor = self._executor()
+        pending = iter(api_paths)
+        q = Queue()
+
+        def request(api_path):
+            """
+            puts the response for api_path into q once the host has a free slot, unless the deadline passes first,
+            followed by an end marker, then starts the request of the next pending path
+            """
+            try:
+                remaining = scheduler.seconds_left(deadline)
+                if remaining == 0 or not host_limit.acquire(timeout=remaining):
+                    return
+                try:
+                    if validators is not None:
+                        api_resp = util.conditional_api_call(api_base, api_path, validators.get(api_path), session)
+                    else:
+                        json_resp = util.api_call(api_base, api_path, None, session)
+                        api_resp = util.ApiResponse(api_path, json_resp) if json_resp is not None else None
+                finally:
+                    host_limit.release()
+                if api_resp is not None:
+                    q.put(api_resp)
+            finally:
+                q.put(None)
+                start_next()
+
+        def start_next():
+            # paths are started as earlier requests finish so a fetch never holds more than limit pool threads
+            with self._lock:
+                api_path = next(pending, None)
+            if api_path is not None and scheduler.seconds_left(deadline) != 0:
+                executor.submit(request, api_path)
+
+        [start_next() for i in range(min(limit, len(api_paths)))]
+        yield from iter_until_deadline(q, deadline, len(api_paths))
+
+    def _executor(self):
+        """
+        returns the thread pool shared by every fetch, started again if the engine was closed
+        """
+        with self._lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+            return self.executor
+
+    def session(self, api_base, pool_size):
+        """
+        returns the pooled requests.Session shared by every request to the host of api_base
+        """
+        host = urlsplit(api_base).netloc
+        with self._lock:
+            if host not in self.sessions:
+                S = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                S.mount('http://', adapter)
+                S.mount('https://', adapter)
+                self.sessions[host] = S
+            return self.sessions[host]
+
+    def close(self):
+        """
+        closes every pooled session and stops the thread pool once its requests have finished
+        """
+        with self._lock:
+            [S.close() for S in self.sessions.values()]
+            self.sessions.clear()
+            self.host_limits.clear()
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+def iter_threaded_fetch(api_base, api_paths, limit=None):
+    """
+    fallback fetch path which starts one thread per api_path, yields each util.ApiResponse as soon as it arrives
+    until every request has finished or the deadline scheduler.default_scheduler had when it started has passed
+    """
+    q = Queue()
+    api_paths = list(api_paths)
+    deadline = scheduler.default_scheduler.deadline
+
+    def request(api_path):
+        try:
+            util.api_call(api_base, api_path, q)
+        finally:
+            # marks this request as finished whether or not it produced a response
+            q.put(None)
+
+    # threads left running at the deadline must not keep the process alive
+    [Thread(target=request, args=(api_path,), daemon=True).start() for api_path in api_paths]
+    yield from iter_until_deadline(q, deadline, len(api_paths))
+
+def iter_until_deadline(q, deadline=None, end_count=1):
+    """
+    yields the items put into q until end_count None end markers have been taken, or until deadline, a
+    time.monotonic() time, passes
+    """
+    ended = 0
+    while ended < end_count:
+        try:
+            item = q.get(timeout=scheduler.seconds_left(deadline))
+        except Empty:
+            return
+        if item is None:
+            ended += 1
+        else:
+            yield item
@@ -0,0 +1,260 @@
+import os
+import sys
+import mmap
+import fcntl
+import time
+import bisect
+from array import array
+from decimal import Decimal, ROUND_DOWN
+from datetime import datetime, timezone
+
+from src import util, writers
+
+# balances, prices and values are stored as integers of 10^-SCALE_DIGITS units
+SCALE_DIGITS = 8
+INT64_MAX = 2 ** 63 - 1
+# (column name, array typecode) of each column file, one row per asset and base currency of a snapshot
+COLUMNS = [('time', 'q'), ('asset', 'I'), ('base', 'I'), ('balance', 'q'), ('price', 'q'), ('value', 'q')]
+
+class HistoryStore(object):
+    def __init__(self, dir_path):
+        """
+        append-only columnar history of portfolio snapshots in dir_path, one file per column and a names.json file
+        interning asset and base currency names, column files are memory-mapped so queries only touch the rows
+        they need, rows are appended in time order so time ranges are found by binary search
+        amounts too large for their column are stored as 0 there and kept as decimal strings in overflow.json
+        """
+        self.dir_path = dir_path
+        self.names_file = os.path.join(dir_path, 'names.json')
+        self.overflow_file = os.path.join(dir_path, 'overflow.json')
+        os.makedirs(dir_path, exist_ok=True)
+        self._maps = {}
+        self._load_names()
+        self._load_overflow()
+
+    def __len__(self):
+        """
+        number of complete rows, a column of a snapshot being appended by another process may be longer
+        """
+        return min(self._file_rows(name, typecode) for name, typecode in COLUMNS)
+
+    def _column(self, name, typecode):
+        """
+        returns a read only memoryview of column name mapped from its file, or an empty array if it has no rows
+        """
+        if name not in self._maps:
+            if self._file_rows(name, typecode) == 0:
+                return array(typecode)
+            with open(self._column_file(name), 'rb') as f:
+                self._maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._maps[name]).cast(typecode)
+
+    def _column_file(self, name):
+        return os.path.join(self.dir_path, name + '.col')
+
+    def _file_rows(self, name, typecode):
+        column_file = self._column_file(name)
+        return os.path.getsize(column_file) // array(typecode).itemsize if os.path.isfile(column_file) else 0
+
+    def _amount(self, name, row):
+        """
+        returns the Decimal amount of column name at row
+        """
+        if name in self.overflow.get(row, {}):
+            return self.overflow[row][name]
+        return Decimal(self._column(name, 'q')[row]).scaleb(-SCALE_DIGITS)
+
+    @staticmethod
+    def _fixed(amount):
+        """
+        returns amount as an integer of 10^-SCALE_DIGITS units, or None if it does not fit a column
+        """
+        fixed_amount = int(Decimal(amount).scaleb(SCALE_DIGITS).to_integral_value(ROUND_DOWN))
+        return fixed_amount if abs(fixed_amount) <= INT64_MAX else None
+
+    def _intern(self, name, names, ids):
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    def _load_names(self):
+        names = util.json_from_file(self.names_file) if os.path.isfile(self.names_file) else {}
+        self.assets = names.get('assets', [])
+        self.bases = names.get('bases', [])
+        self.asset_ids = {asset_name: i for i, asset_name in enumerate(self.assets)}
+        self.base_ids = {base_currency: i for i, base_currency in enumerate(self.bases)}
+
+    def _load_overflow(self):
+        overflow = util.json_from_file(self.overflow_file) if os.path.isfile(self.overflow_file) else {}
+        # {row:{column_name:Decimal(amount), }, } of the amounts too large for their column
+        self.overflow = {int(row): {name: Decimal(amount) for name, amount in amounts.items()}
+                         for row, amounts in overflow.items()}
+
+    def _repair(self):
+        """
+        creates missing column files and truncates every column to the shortest one, dropping the partly written
+        rows of a snapshot interrupted while it was appended, returns the number of rows
+        """
+        row_count = len(self)
+        for name, typecode in COLUMNS:
+            with open(self._column_file(name), 'ab') as f:
+                if f.tell() != row_count * array(typecode).itemsize:
+                    f.truncate(row_count * array(typecode).itemsize)
+        return row_count
+
+    def append(self, rows, timestamp=None):
+        """
+        appends a snapshot of rows [(asset_name, base_currency, balance, price, value), ] taken at timestamp,
+        unix seconds defaulting to now, a timestamp not after the last snapshot is stored one second after it
+        so the time column stays sorted and every snapshot has its own time
+        appends hold an exclusive lock on the store so a daemon and single runs can share it
+        """
+        if not rows:
+            return
+        self.close()
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        with open(os.path.join(self.dir_path, 'lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # names and overflow may have been added by another process since this store was opened
+            self._load_names()
+            self._load_overflow()
+            row_count = self._repair()
+            if row_count:
+                timestamp = max(timestamp, self._column('time', 'q')[row_count - 1] + 1)
+                self.close()
+
+            name_count = len(self.assets) + len(self.bases)
+            # overflow of rows dropped by _repair() would otherwise be read as part of the rows appended now
+            overflow_count = len(self.overflow)
+            self.overflow = {row: amounts for row, amounts in self.overflow.items() if row < row_count}
+            overflow_changed = len(self.overflow) < overflow_count
+            columns = {name: array(typecode) for name, typecode in COLUMNS}
+            for i, (asset_name, base_currency, balance, price, value) in enumerate(rows):
+                columns['time'].append(timestamp)
+                columns['asset'].append(self._intern(asset_name, self.assets, self.asset_ids))
+                columns['base'].append(self._intern(base_currency, self.bases, self.base_ids))
+                for name, amount in (('balance', balance), ('price', price), ('value', value)):
+                    fixed_amount = self._fixed(amount)
+                    if fixed_amount is None:
+                        self.overflow.setdefault(row_count + i, {})[name] = Decimal(amount)
+                        overflow_changed = True
+                    columns[name].append(fixed_amount or 0)
+            if len(self.assets) + len(self.bases) > name_count:
+                util.json_to_file(self.names_file + '.tmp', {'assets': self.assets, 'bases': self.bases})
+                os.replace(self.names_file + '.tmp', self.names_file)
+            if overflow_changed:
+                util.json_to_file(self.overflow_file + '.tmp',
+                                  {str(row): {name: str(amount) for name, amount in amounts.items()}
+                                   for row, amounts in self.overflow.items()})
+                os.replace(self.overflow_file + '.tmp', self.overflow_file)
+
+            for name, typecode in COLUMNS:
+                with open(self._column_file(name), 'ab') as f:
+                    columns[name].tofile(f)
+
+    def close(self):
+        """
+        unmaps the column files, they are mapped again on the next query
+        """
+        [column_map.close() for column_map in self._maps.values()]
+        self._maps = {}
+
+    def query(self, base_currency, start=None, end=None, every=None, asset_name=None):
+        """
+        returns [(time, balance, price, value), ] of asset_name valued in base_currency, or [(time, total_value), ]
+        of every asset if asset_name is None, for snapshots with start <= time < end
+        if every is given the series is downsampled to the last snapshot in each every seconds long interval,
+        which costs a binary search per interval rather than a pass over every snapshot in the range
+        """
+        if base_currency not in self.base_ids or (asset_name is not None and asset_name not in self.asset_ids):
+            return []
+        times = self._column('time', 'q')[:len(self)]
+        lo = 0 if start is None else bisect.bisect_left(times, int(start))
+        hi = len(times) if end is None else bisect.bisect_left(times, int(end))
+
+        series = []
+        for snapshot_lo, snapshot_hi in self._snapshots(times, lo, hi, every):
+            row = self._snapshot_row(snapshot_lo, snapshot_hi, self.base_ids[base_currency],
+                                     None if asset_name is None else self.asset_ids[asset_name])
+            if row is not None:
+                series.append((times[snapshot_lo],) + row)
+        return series
+
+    def _snapshot_row(self, lo, hi, base_id, asset_id):
+        """
+        returns (balance, price, value) of asset_id or (total_value,) of every asset valued in base_id from the
+        rows lo to hi of a single snapshot, or None if the snapshot holds no matching rows
+        """
+        bases = self._column('base', 'I')
+        assets = self._column('asset', 'I')
+        if asset_id is None:
+            values = self._column('value', 'q')
+            matches = [i for i in range(lo, hi) if bases[i] == base_id]
+            if not matches:
+                return None
+            total_value = Decimal(sum(values[i] for i in matches)).scaleb(-SCALE_DIGITS)
+            return (total_value + sum(self.overflow[i]['value'] for i in matches
+                                      if 'value' in self.overflow.get(i, {})),)
+        for i in range(lo, hi):
+            if bases[i] == base_id and assets[i] == asset_id:
+                return tuple(self._amount(name, i) for name in ('balance', 'price', 'value'))
+        return None
+
+    @staticmethod
+    def _snapshots(times, lo, hi, every=None):
+        """
+        yields (first_row, end_row) of each snapshot between rows lo and hi of the sorted times column, or only of
+        the last snapshot of each every seconds long interval
+        """
+        while lo < hi:
+            if every:
+                bucket_end = (times[lo] // every + 1) * every
+                next_lo = min(hi, bisect.bisect_left(times, bucket_end, lo, hi))
+                snapshot_lo = bisect.bisect_left(times, times[next_lo - 1], lo, next_lo)
+            else:
+                next_lo = bisect.bisect_right(times, times[lo], lo, hi)
+                snapshot_lo = lo
+            yield snapshot_lo, next_lo
+            lo = next_lo
+
+def snapshot_rows(P):
+    """
+    returns [(asset_name, base_currency, balance, price, value), ] of the filtered asset totals of Portfolio P
+    after its prices have been applied
+    """
+    rows = []
+    asset_values = P.get_asset_values()
+    for asset_name, balance in P.get_asset_totals().items():
+        for base_currency, value in zip(P.base_currencies, asset_values[asset_name]):
+            rows.append((asset_name, base_currency, balance, P.base_prices[base_currency][asset_name], value))
+    return rows
+
+def parse_time(text):
+    """
+    returns unix seconds from text, either unix seconds or an ISO 8601 date or date and time, taken as UTC
+    unless it carries a UTC offset
+    """
+    if text.isdigit():
+        return int(text)
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+def write_series(series, base_currency, asset_name=None, fmt='table', value_prec_digits=8, out=sys.stdout):
+    """
+    writes series from HistoryStore.query() to out as a table or in fmt, 'jsonl' or 'csv', with UTC ISO 8601 times
+    """
+    fields = ['time', 'value'] if asset_name is None else ['time', 'balance', 'price', 'value']
+    W = writers.WRITERS[fmt](out, fields) if fmt != 'table' else None
+    for row in series:
+        moment = datetime.fromtimestamp(row[0], timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        amounts = ['{0:.{prec}f}'.format(amount, prec=int(value_prec_digits)) for amount in row[1:]]
+        if W:
+            W.write([moment] + amounts)
+        elif asset_name is None:
+            print('{0}  {1} {2}'.format(moment, amounts[0], base_currency), file=out)
+        else:
+            print('{0}  {1} {2} @ {3} = {4} {5}'.format(moment, amounts[0], asset_name, amounts[1], amounts[2],
+                                                        base_currency), file=out)
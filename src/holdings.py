@@ -0,0 +1,241 @@
+from array import array
+from decimal import Decimal
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# balances are stored as integers of 10^-SCALE_DIGITS units, the precision asset balances are printed at
+SCALE_DIGITS = 8
+INT64_MAX = 2 ** 63 - 1
+# address id of rows freed by set_address(), which every query skips
+FREE_ID = 2 ** 32 - 1
+# freed rows are compacted away once there are at least this many and they make up half of the rows
+COMPACT_MIN = 1024
+
+class HoldingsTable(object):
+    def __init__(self):
+        """
+        columnar table of (address_id, asset_id, fixed_point_balance) rows, addresses and asset names are interned
+        to integer ids, columns are array buffers which are used through numpy without copying when it is installed
+        the rows of each address are contiguous and in the order its assets were set, address ids are in the order
+        addresses were first seen, which is the order addresses and assets are returned in
+        balances are rounded to SCALE_DIGITS decimal places as they are set, those too large for the balance column
+        are kept as Decimals in self.overflow with a column balance of 0
+        """
+        self.addrs = []
+        self.assets = []
+        self.addr_ids = {}
+        self.asset_ids = {}
+        self.addr_col = array('L')
+        self.asset_col = array('L')
+        self.balance_col = array('q')
+        # first row and row count of each address id, for tables filled through set_address()
+        self.addr_start = array('q')
+        self.addr_count = array('L')
+        # {row:Decimal(balance), } of balances too large for the balance column
+        self.overflow = {}
+        self.free_count = 0
+
+    def __len__(self):
+        """
+        number of rows holding a balance
+        """
+        return len(self.balance_col) - self.free_count
+
+    def add_address(self, addr):
+        """
+        interns addr without any rows so its place in the address order is set before its balances arrive
+        """
+        addr_id = self._intern(addr, self.addrs, self.addr_ids)
+        while len(self.addr_start) <= addr_id:
+            self.addr_start.append(0)
+            self.addr_count.append(0)
+        return addr_id
+
+    def address_balances(self):
+        """
+        returns {address:{asset_name:Decimal(balance), }, } of every address holding a row
+        """
+        grouped = {}
+        rows = zip(self.addr_col, self.asset_col, self.balance_col)
+        for row, (addr_id, asset_id, fixed_balance) in enumerate(rows):
+            if addr_id != FREE_ID:
+                balance = self.overflow[row] if row in self.overflow else Decimal(fixed_balance).scaleb(-SCALE_DIGITS)
+                grouped.setdefault(addr_id, {})[self.assets[asset_id]] = balance
+        return {self.addrs[addr_id]: grouped[addr_id] for addr_id in sorted(grouped)}
+
+    def asset_names(self):
+        """
+        returns set of the asset names held by any row
+        """
+        if numpy is not None:
+            asset_ids = numpy.unique(self._np(self.asset_col)[self._live_rows()]).tolist()
+        else:
+            asset_ids = {asset_id for addr_id, asset_id in zip(self.addr_col, self.asset_col) if addr_id != FREE_ID}
+        return {self.assets[asset_id] for asset_id in asset_ids}
+
+    def _asset_order(self):
+        """
+        returns the asset ids held by any row in the order they are first held, going through addresses in order
+        """
+        if numpy is not None:
+            live_rows = self._live_rows()
+            rows = live_rows[numpy.argsort(self._np(self.addr_col)[live_rows], kind='stable')]
+            asset_ids, first_positions = numpy.unique(self._np(self.asset_col)[rows], return_index=True)
+            return asset_ids[numpy.argsort(first_positions)].tolist()
+        rows = sorted((row for row, addr_id in enumerate(self.addr_col) if addr_id != FREE_ID),
+                      key=self.addr_col.__getitem__)
+        return list(dict.fromkeys(self.asset_col[row] for row in rows))
+
+    def asset_totals(self):
+        """
+        returns {asset_name:Decimal(total_balance)} summed over every row
+        """
+        if numpy is not None:
+            fixed_totals = numpy.zeros(len(self.assets), dtype=numpy.int64)
+            numpy.add.at(fixed_totals, self._np(self.asset_col), self._np(self.balance_col))
+            fixed_totals = fixed_totals.tolist()
+        else:
+            fixed_totals = [0] * len(self.assets)
+            for asset_id, fixed_balance in zip(self.asset_col, self.balance_col):
+                fixed_totals[asset_id] += fixed_balance
+        totals = {asset_id: Decimal(fixed_totals[asset_id]).scaleb(-SCALE_DIGITS) for asset_id in self._asset_order()}
+        for row, balance in self.overflow.items():
+            totals[self.asset_col[row]] += balance
+        return {self.assets[asset_id]: total for asset_id, total in totals.items()}
+
+    def asset_values(self, asset_prices):
+        """
+        returns {asset_name:total_value} for the totals of every asset valued at {asset_name:price}
+        """
+        return {asset_name: total * asset_prices.get(asset_name, 0)
+                for asset_name, total in self.asset_totals().items()}
+
+    def _compact(self):
+        """
+        drops freed rows, keeping the order of the other rows
+        """
+        live_rows = [row for row, addr_id in enumerate(self.addr_col) if addr_id != FREE_ID]
+        new_rows = {row: new_row for new_row, row in enumerate(live_rows)}
+        self.addr_col = array('L', (self.addr_col[row] for row in live_rows))
+        self.asset_col = array('L', (self.asset_col[row] for row in live_rows))
+        self.balance_col = array('q', (self.balance_col[row] for row in live_rows))
+        self.overflow = {new_rows[row]: balance for row, balance in self.overflow.items()}
+        for addr_id in range(len(self.addr_start)):
+            if self.addr_count[addr_id]:
+                self.addr_start[addr_id] = new_rows[self.addr_start[addr_id]]
+        self.free_count = 0
+
+    def filter(self, min_balance=0, excluded_assets=[]):
+        """
+        returns a new HoldingsTable sharing interned ids, keeping rows whose balance is above min_balance and whose
+        asset is not in excluded_assets
+        """
+        min_balance = Decimal(min_balance)
+        min_fixed = int(min_balance.scaleb(SCALE_DIGITS))
+        excluded_ids = [self.asset_ids[asset_name] for asset_name in excluded_assets if asset_name in self.asset_ids]
+
+        T = HoldingsTable()
+        T.addrs, T.assets, T.addr_ids, T.asset_ids = self.addrs, self.assets, self.addr_ids, self.asset_ids
+        if numpy is not None:
+            balances = self._np(self.balance_col)
+            addr_col = self._np(self.addr_col)
+            asset_col = self._np(self.asset_col)
+            mask = (balances > min_fixed) & (addr_col != FREE_ID) & ~numpy.isin(asset_col, excluded_ids)
+            for row, balance in self.overflow.items():
+                mask[row] = balance > min_balance and self.asset_col[row] not in excluded_ids
+            if self.overflow:
+                new_rows = numpy.cumsum(mask) - 1
+                T.overflow = {int(new_rows[row]): balance for row, balance in self.overflow.items() if mask[row]}
+            T.addr_col = array('L', addr_col[mask].tobytes())
+            T.asset_col = array('L', asset_col[mask].tobytes())
+            T.balance_col = array('q', balances[mask].tobytes())
+        else:
+            excluded_ids = set(excluded_ids)
+            rows = zip(self.addr_col, self.asset_col, self.balance_col)
+            for row, (addr_id, asset_id, fixed_balance) in enumerate(rows):
+                if addr_id == FREE_ID or asset_id in excluded_ids:
+                    continue
+                if row in self.overflow:
+                    if self.overflow[row] <= min_balance:
+                        continue
+                    T.overflow[len(T.balance_col)] = self.overflow[row]
+                elif fixed_balance <= min_fixed:
+                    continue
+                T.addr_col.append(addr_id)
+                T.asset_col.append(asset_id)
+                T.balance_col.append(fixed_balance)
+        return T
+
+    @staticmethod
+    def _fixed(balance):
+        """
+        returns balance rounded to an integer of 10^-SCALE_DIGITS units, or None if it does not fit the balance column
+        """
+        fixed_balance = int(Decimal(balance).scaleb(SCALE_DIGITS).to_integral_value())
+        return fixed_balance if abs(fixed_balance) <= INT64_MAX else None
+
+    def _free(self, start, count):
+        for row in range(start, start + count):
+            self.addr_col[row] = FREE_ID
+            self.balance_col[row] = 0
+            self.overflow.pop(row, None)
+        self.free_count += count
+
+    @staticmethod
+    def _intern(key, keys, key_ids):
+        if key not in key_ids:
+            key_ids[key] = len(keys)
+            keys.append(key)
+        return key_ids[key]
+
+    def _live_rows(self):
+        return numpy.flatnonzero(self._np(self.addr_col) != FREE_ID)
+
+    def nbytes(self):
+        """
+        returns bytes used by the column buffers
+        """
+        return sum(col.itemsize * len(col) for col in (self.addr_col, self.asset_col, self.balance_col,
+                                                       self.addr_start, self.addr_count))
+
+    @staticmethod
+    def _np(col):
+        if not len(col):
+            return numpy.array([], dtype=numpy.int64)
+        return numpy.frombuffer(col, dtype=numpy.dtype(col.typecode))
+
+    def set_address(self, addr, balances):
+        """
+        replaces the rows of addr with a row for each {asset_name:balance, } of balances, in order, balances are
+        rounded to SCALE_DIGITS decimal places
+        the rows of addr are rewritten in place when there are enough of them, otherwise they are freed and new
+        rows appended, freed rows are compacted away once they make up half of the table
+        """
+        addr_id = self.add_address(addr)
+        start, count = self.addr_start[addr_id], self.addr_count[addr_id]
+        if len(balances) > count:
+            self._free(start, count)
+            start, count = len(self.balance_col), 0
+        for i, (asset_name, balance) in enumerate(balances.items()):
+            row = start + i
+            asset_id = self._intern(asset_name, self.assets, self.asset_ids)
+            fixed_balance = self._fixed(balance)
+            if i >= count:
+                self.addr_col.append(addr_id)
+                self.asset_col.append(asset_id)
+                self.balance_col.append(0)
+            self.asset_col[row] = asset_id
+            if fixed_balance is None:
+                self.balance_col[row] = 0
+                self.overflow[row] = Decimal(balance)
+            else:
+                self.balance_col[row] = fixed_balance
+                self.overflow.pop(row, None)
+        if len(balances) < count:
+            self._free(start + len(balances), count - len(balances))
+        self.addr_start[addr_id], self.addr_count[addr_id] = start, len(balances)
+        if self.free_count >= COMPACT_MIN and self.free_count * 2 >= len(self.balance_col):
+            self._compact()
@@ -0,0 +1,120 @@
+import sys
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+from src import asset, util, profiler, writers
+
+def fetch_stage(P):
+    """
+    yields (address, family, {asset_name:balance, }) from Portfolio P as the balances of each address arrive
+    """
+    for Fam, addr, changed in P.iter_refresh():
+        if changed:
+            yield addr, Fam(), P.family_balances[Fam()][addr]
+
+def filter_stage(stream, excluded_assets, min_balance):
+    """
+    drops excluded assets and balances not above min_balance, and addresses left without any assets
+    """
+    min_balance = int(min_balance)
+    for addr, family, assets in stream:
+        filtered = {asset_name: balance for asset_name, balance in assets.items()
+                    if asset_name not in excluded_assets and balance > min_balance}
+        if filtered:
+            yield addr, family, filtered
+
+def price_stage(stream, prices_future, base_currencies):
+    """
+    yields (address, family, [(asset_name, balance, [value, ]), ]) with one value per base currency in
+    base_currencies once asset.Prices from prices_future is ready
+    """
+    rate_tables = None
+    for addr, family, assets in stream:
+        if rate_tables is None:
+            AP = prices_future.result()
+            rate_tables = [AP.rate_table(base_currency) for base_currency in base_currencies]
+        rows = []
+        for asset_name, balance in assets.items():
+            asset_values = [balance * rates.get(asset_name.upper(), Decimal(0)) for rates in rate_tables]
+            rows.append((asset_name, balance, asset_values))
+        yield addr, family, rows
+
+def render_stage(P, stream, itemize, asset_prec_digits, value_prec_digits, out=sys.stdout, progress=sys.stderr,
+                 fmt='table'):
+    """
+    prints each address as it arrives when itemize is true, and keeps a running total value per base currency
+    of Portfolio P which is reported on progress while results stream in, returns the running total values
+    fmt 'jsonl' or 'csv' writes itemized rows with writers instead of the dot filled table
+    stale addresses are marked as such and addresses without any balances are listed as missing at the end
+    """
+    value_prec_digits = int(value_prec_digits)
+    asset_prec = Decimal('1.{0}'.format('0'*asset_prec_digits))
+    show_progress = progress.isatty()
+    W = writers.writer(fmt, out, P.base_currencies, itemize=True) if itemize and fmt != 'table' else None
+
+    addr_count = 0
+    total_values = [Decimal(0)] * len(P.base_currencies)
+    for addr, family, rows in stream:
+        addr_count += 1
+        for asset_name, balance, asset_values in rows:
+            total_values = [total + value for total, value in zip(total_values, asset_values)]
+        if W:
+            status = P.address_status(addr)
+            for asset_name, balance, asset_values in rows:
+                W.write([addr] + writers.balance_row(asset_name, balance, asset_values,
+                                                     asset_prec_digits, value_prec_digits) + [status])
+            out.flush()
+        elif itemize:
+            fmt_rows = [(asset_name, balance.quantize(asset_prec), asset_values)
+                        for asset_name, balance, asset_values in rows]
+            longest_width = max(len('{0}{1}'.format(asset_name, balance)) for asset_name, balance, _ in fmt_rows)
+            print(P.format_address(addr, family), file=out)
+            for asset_name, balance, asset_values in fmt_rows:
+                fill = '.' * (longest_width - len('{0}{1}'.format(asset_name, balance)) + 5)
+                print(P.format_line(asset_name, fill, balance, asset_values, asset_prec_digits, value_prec_digits),
+                      file=out)
+            print(file=out)
+            out.flush()
+        if show_progress:
+            totals = '  '.join('{0:.{val_prec}f} {1}'.format(total, base_currency, val_prec=value_prec_digits)
+                               for total, base_currency in zip(total_values, P.base_currencies))
+            print('\r{0} addresses, total value {1}'.format(addr_count, totals), end='', file=progress)
+    if show_progress:
+        print(file=progress)
+    for addr in P.missing_addresses() if itemize else []:
+        if W:
+            W.write(writers.missing_row(addr, P.base_currencies))
+        else:
+            print('{0} (missing)'.format(addr), file=out)
+            print(file=out)
+    return total_values
+
+@profiler.default_profiler.timed()
+def stream_balances(P, base_currencies, min_balance, asset_prec_digits, value_prec_digits, itemize=False,
+                    snapshot_file=None, refresh_prices=False, fmt='table'):
+    """
+    fetches, filters, prices and renders the balances of Portfolio P as streaming stages so output starts with the
+    first response rather than the slowest, prices are retrieved in the background while balances are fetched
+    totals of the whole portfolio are printed once every address has been rendered, in fmt as described in
+    render_stage()
+    """
+    P.base_currencies = util.currency_list(base_currencies)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        prices_future = executor.submit(asset.Prices, snapshot_file, refresh=refresh_prices)
+        stream = fetch_stage(P)
+        stream = filter_stage(stream, P.excluded_assets, min_balance)
+        stream = price_stage(stream, prices_future, P.base_currencies)
+        render_stage(P, stream, itemize, asset_prec_digits, value_prec_digits, fmt=fmt)
+
+        P.prices = prices_future.result()
+    P.filter_addr_assets(min_balance)
+    # held assets are only known once every balance has arrived, those the snapshot in use has no price for are
+    # fetched for the totals
+    if not P.prices.covers(P.unique_assets | set(P.base_currencies)):
+        P.retrieve_asset_prices(P.base_currencies, snapshot_file)
+    else:
+        P.apply_prices(P.base_currencies)
+    if not itemize and fmt != 'table':
+        P.write_total_balances(fmt, asset_prec_digits, value_prec_digits)
+    elif not itemize:
+        P.print_total_balances(asset_prec_digits, value_prec_digits)
@@ -1,9 +1,15 @@
+import sys
+import time
+from decimal import Decimal
 from queue import Queue
 from threading import Thread
-from decimal import Decimal
+from collections import deque
+from datetime import datetime, timezone
 
-from src import util, asset
-from src.asset import Asset
+from src import util, asset, fetch, scheduler, profiler, writers, archive, singleflight
+from src.cache import BalanceCache
+from src.batching import AdaptiveBatcher, TARGET_LATENCY
+from src.holdings import HoldingsTable
 
 class Family(object):
     def __init__(self, family, conf):
@@ -15,94 +21,244 @@ class Family(object):
         self.multi_asset_flag = conf[self.family]['MULTI_ASSET_FLAG']
         self.group_request_flag = conf[self.family]['MULTI_REQUEST_FLAG_MAX'][0]
         self.multi_request_max = conf[self.family]['MULTI_REQUEST_FLAG_MAX'][1]
+        # upper bound for the adaptive batch size of grouped requests, MULTI_REQUEST_FLAG_MAX is the starting size
+        self.max_batch_size = conf[self.family].get('MAX_BATCH_SIZE', self.multi_request_max)
         self.multiplier = conf[self.family]['MULTIPLIER']
+        self.max_concurrency = conf[self.family].get('MAX_CONCURRENCY', fetch.DEFAULT_CONCURRENCY)
+        self.cache_ttl = conf[self.family].get('CACHE_TTL', 0)
+        # [requests_per_second, burst], null leaves the api host unthrottled
+        self.rate_limit = conf[self.family].get('RATE_LIMIT') or [None, 1]
+        self.timeout = conf[self.family].get('TIMEOUT', scheduler.DEFAULT_TIMEOUT)
+        self.retries = conf[self.family].get('RETRIES', scheduler.DEFAULT_RETRIES)
+        # optional {'METHOD':'etag'|'probe'|'tip', 'API', 'PATH', 'KEY'} check for unchanged balances, see README
+        self.change_check = conf[self.family].get('CHANGE_CHECK') or {}
+        self.change_method = self.change_check.get('METHOD')
         self.standard_flag = not any([self.multi_asset_flag, self.group_request_flag])
+        # key paths are compiled once per family rather than resolved for every address and asset
+        self.get_data = util.compile_key_path(self.data_key)
+        self.get_id = util.compile_key_path(self.id_key)
+        self.get_balance = util.compile_key_path(self.balance_key)
+        self.get_marker = util.compile_key_path(self.change_check.get('KEY', []))
         self.addresses = []
     def __call__(self, *args, **kwargs):
         return self.family
 
 class Portfolio(object):
-    def __init__(self, addr_data, addr_config, excluded_assets=[]):
+    def __init__(self, addr_data, addr_config, excluded_assets=[], threaded=False, cache_file=None, refresh=True):
+        """
+        fetches balances for every address in addr_data, if cache_file is provided balances cached there which are
+        younger than the CACHE_TTL of their family are used instead of being fetched again
+        if refresh is false nothing is fetched until refresh() or iter_refresh() is called
+        """
         self.addr_families = []
-        self.addr_assets = {}
-        self.filtered_addr_assets = {}
+        # holdings.HoldingsTable of the balances of every address combined over its families, and the rows of it
+        # kept by filter_addr_assets()
+        self.holdings = HoldingsTable()
+        self.filtered_holdings = HoldingsTable()
         self.excluded_assets = [i.upper() for i in excluded_assets]
         self.unique_assets = set()
         self.asset_prices = {}
+        # {base_currency:{asset_name:price, }, } for every requested base, self.asset_prices is the first base
+        self.base_prices = {}
+        self.base_currencies = []
+        self.prices = None
+        self.threaded = threaded
+        self.engine = fetch.FetchEngine()
+        self.cache = BalanceCache(cache_file)
+        # {family:{address:{asset_name:balance, }, }, } as last fetched for each family
+        self.family_balances = {}
+        # {family:[address, ], } of addresses whose requests failed after every retry or ran out of time
+        self.failed_addresses = {}
+        # {family:{address:fetch_time, }, } of failed addresses holding their last known balances from the cache
+        self.stale_addresses = {}
+        # {family:{address:marker, }, } change check markers to store with the next fetched balances of each address
+        self.markers = {}
+        # {family:set(address, ), } of addresses an etag family api reported as not modified
+        self.not_modified = {}
+        # {family:count, } of addresses listed more than once for a family, each is fetched and counted once
+        self.merged_addresses = {}
+        # requests of the last refresh answered by an identical request instead of being made again
+        self.shared_requests = 0
 
         for addr_type, addr_lst in addr_data.items():
             F = Family(addr_type, addr_config)
+            scheduler.default_scheduler.configure(F.api_base, F.rate_limit[0], F.rate_limit[1], F.timeout, F.retries)
+            profiler.default_profiler.label(F.api_base, F())
+            family_addrs = set()
             for addr in addr_lst:
-                # initialize empty dict which will be filled with {asset_name:asset_obj,}
-                self.addr_assets[addr] = {}
+                if addr in family_addrs:
+                    self.merged_addresses[F()] = self.merged_addresses.get(F(), 0) + 1
+                    continue
+                family_addrs.add(addr)
+                # addresses are listed in the order they are configured, whenever their balances arrive
+                self.holdings.add_address(addr)
                 # expand address list for each family object to match address config file
                 F.addresses.append(addr)
             self.addr_families.append(F)
 
+        if refresh:
+            self.refresh()
+            self.engine.close()
+
+    @staticmethod
+    def _add_balance(balances, addr, asset_name, asset_balance):
+        """
+        adds asset_balance to balances[addr][asset_name] where balances is {address:{asset_name:Decimal(balance), }, }
+        """
+        addr_balances = balances.setdefault(addr, {})
+        addr_balances[asset_name] = addr_balances.get(asset_name, 0) + Decimal(asset_balance)
+
+    def _coalesced_group_families(self):
+        """
+        returns lists of grouped request families which share an api and response layout, so their addresses
+        can be batched into the same api calls
+        """
+        coalesced = {}
         for Fam in self.addr_families:
-            if Fam.multi_asset_flag:
-                self._multi_asset_request(Fam)
-            elif Fam.group_request_flag:
-                self._group_request(Fam)
-            elif Fam.standard_flag:
-                self._standard_request(Fam)
+            if self._is_grouped(Fam):
+                group_key = (Fam.api_base, tuple(Fam.data_key), tuple(Fam.id_key), tuple(Fam.balance_key))
+                coalesced.setdefault(group_key, []).append(Fam)
+        return list(coalesced.values())
+
+    def _conditional_fetch(self, F, addresses):
+        """
+        yields util.ApiResponse for each address of etag family F whose balances changed, sending the validators
+        stored with its cached balances, addresses the api reports as not modified are added to self.not_modified
+        """
+        validators = {addr: self.cache.marker(F(), addr) for addr in addresses}
+        for api_resp in self.engine.iter_fetch(F.api_base, addresses, F.max_concurrency, validators):
+            if api_resp.json_response is None:
+                self.not_modified.setdefault(F(), set()).add(api_resp.api_path)
+            else:
+                self.markers.setdefault(F(), {})[api_resp.api_path] = api_resp.validators
+                yield util.ApiResponse(api_resp.api_path, api_resp.json_response)
 
+    def _fetch(self, F, api_paths):
+        """
+        yields util.ApiResponse for each api_path of family F as responses arrive, through the pooled fetch engine
+        unless the threaded fallback was requested
+        requests of etag families are conditional, except grouped ones whose batches differ from run to run
+        """
+        if self.threaded:
+            return fetch.iter_threaded_fetch(F.api_base, api_paths)
+        if F.change_method == 'etag' and not self._is_grouped(F):
+            return self._conditional_fetch(F, api_paths)
+        return self.engine.iter_fetch(F.api_base, api_paths, F.max_concurrency)
+
+    @profiler.default_profiler.timed()
+    def apply_prices(self, base_currencies, AP=None):
+        """
+        fills self.base_prices with {base_currency:{asset_name:price, }, } for every filtered asset and each of
+        base_currencies, a currency code, comma separated codes or a list of codes, and self.asset_prices with the
+        prices of the first base currency, from asset.Prices AP or from the prices last retrieved by retrieve_asset_prices()
+        """
+        AP = AP or self.prices
+        self.base_currencies = util.currency_list(base_currencies)
+        self.base_prices = {}
+        for base_currency in self.base_currencies:
+            rates = AP.rate_table(base_currency)
+            self.base_prices[base_currency] = {asset_name: rates.get(asset_name.upper(), Decimal(0))
+                                               for asset_name in self.unique_assets}
+        self.asset_prices = self.base_prices[self.base_currencies[0]]
+
+    def address_balances(self):
+        """
+        returns {address:{asset_name:Decimal(balance), }, } of the filtered holdings of every address holding any
+        """
+        return self.filtered_holdings.address_balances()
+
+    def address_status(self, addr):
+        """
+        returns 'stale' if a family of addr holds its last known balances after its request failed, otherwise 'fresh'
+        """
+        return 'stale' if any(addr in stale for stale in self.stale_addresses.values()) else 'fresh'
+
+    def asset_values(self, asset_name, balance):
+        """
+        returns list of values of balance of asset_name in each of self.base_currencies
+        """
+        return [balance * self.base_prices[base_currency][asset_name] for base_currency in self.base_currencies]
+
+    @profiler.default_profiler.timed()
     def filter_addr_assets(self, min_balance):
         """
-        fills self.filtered_addr_assets with {address:{asset_name:asset_obj, }, }
-            if assets not in exclusion list, asset balance > 0, and if address has associated assets after filtering
-        """
-        min_balance = int(min_balance)
-        filtered_addr_assets = {}
-        for addr, asset_data in self.addr_assets.items():
-            filtered_addr_assets[addr] = {}
-            for asset_name, asset_obj in asset_data.items():
-                if asset_name not in self.excluded_assets and asset_obj.balance > min_balance:
-                    filtered_addr_assets[addr][asset_name] = asset_obj
-                    self.unique_assets.add(asset_name)
-        for addr, asset_data in filtered_addr_assets.items():
-            if len(filtered_addr_assets[addr]) > 0:
-                self.filtered_addr_assets[addr] = asset_data
+        fills self.filtered_holdings with the holdings whose assets are not in the exclusion list and whose
+        balance > min_balance, and self.unique_assets with their asset names
+        """
+        self.filtered_holdings = self.holdings.filter(int(min_balance), self.excluded_assets)
+        self.unique_assets = self.filtered_holdings.asset_names()
 
+    @profiler.default_profiler.timed()
     def get_asset_totals(self):
         """
         returns dictionary of {asset:balance} with combined totals for all address assets
         """
-        asset_totals = {}
-        for asset_data in self.filtered_addr_assets.values():
-            for asset_name, asset_obj in asset_data.items():
-                if asset_name in asset_totals:
-                    asset_totals[asset_name] += asset_obj.balance
-                else:
-                    asset_totals[asset_name] = asset_obj.balance
-        return asset_totals
+        return self.filtered_holdings.asset_totals()
 
-    def _group_request(self, F):
+    @profiler.default_profiler.timed()
+    def get_asset_values(self):
         """
-        multithreaded api requests for addresses where the specified api allows multiple addresses grouped into one api call
+        returns dictionary of {asset:[value, ]} with the value of the combined total of each asset in each of
+        self.base_currencies
         """
-        q = Queue()
-        threads = []
-        max_per_call = F.multi_request_max
-        addr_lst_chunks = util.chunk_list(list(F.addresses), max_per_call)
-
-        for nested_lst in addr_lst_chunks:
-            addr_payload = util.merge_lst(nested_lst, ['', ','])
-            threads.append(Thread(target=util.api_call, args=(F.api_base, addr_payload, q)))
-            threads[-1].start()
-        [t.join() for t in threads]
-        while not q.empty():
-            # need to get address from within json reponse to differentiate the balance data,
-            # ignore address in position 0 of [address, response] that is returned from q.get()
-            json_resp = q.get().json_response
-            resp_data = util.json_value_by_key(json_resp, F.data_key)
-            for addr_data in resp_data:
-                addr = util.json_value_by_key(addr_data, F.id_key)
-                # blockr api sometime sends more responses than were requested as {'':0}, filter them out
-                if addr != '':
-                    asset_name = F()
-                    asset_balance = util.json_value_by_key(addr_data, F.balance_key) * F.multiplier
-                    self._update_balance(addr, asset_name, asset_balance)
+        base_values = [self.filtered_holdings.asset_values(self.base_prices[base_currency])
+                       for base_currency in self.base_currencies]
+        return {asset_name: [values[asset_name] for values in base_values] for asset_name in self.get_asset_totals()}
+
+    @profiler.default_profiler.timed()
+    def _group_request(self, Fams, family_addrs):
+        """
+        concurrent api requests for addresses where the specified api allows multiple addresses grouped into one api call
+        addresses of every family in Fams are merged into the same calls, whose size adapts to observed latency and
+        failures, and failed calls are retried as smaller batches
+        yields (family_obj, address, {asset_name:balance, }) for each family in Fams as responses arrive
+        """
+        F = Fams[0]
+        addr_families = {}
+        for Fam in Fams:
+            for addr in family_addrs[Fam()]:
+                addr_families.setdefault(addr, []).append(Fam)
+
+        # batch sizes of archived runs depend on failures only, not timing, so a replay makes the recorded calls
+        batcher = AdaptiveBatcher(min(Fam.multi_request_max for Fam in Fams),
+                                  maximum=min(Fam.max_batch_size for Fam in Fams),
+                                  target_latency=float('inf') if archive.active else TARGET_LATENCY)
+        concurrency = min(Fam.max_concurrency for Fam in Fams)
+        pending = deque(addr_families)
+        # batches left once the run deadline has passed are not requested, their addresses count as failed
+        deadline = scheduler.default_scheduler.deadline
+        while pending and scheduler.seconds_left(deadline) != 0:
+            addr_chunks = batcher.next_chunks(pending, concurrency)
+            addr_payloads = {util.merge_lst(chunk, ['', ',']): chunk for chunk in addr_chunks}
+            failed_payloads = set(addr_payloads)
+
+            start = time.time()
+            for api_resp in self._fetch(F, list(addr_payloads)):
+                # need to get address from within json reponse to differentiate the balance data,
+                # ignore address payload in position 0 of [address, response]
+                failed_payloads.discard(api_resp.api_path)
+                balances = {Fam(): {} for Fam in Fams}
+                resp_data = F.get_data(api_resp.json_response)
+                for addr_data in resp_data:
+                    addr = F.get_id(addr_data)
+                    # blockr api sometime sends more responses than were requested as {'':0}, filter them out
+                    if addr in addr_families:
+                        for Fam in addr_families[addr]:
+                            asset_balance = Fam.get_balance(addr_data) * Fam.multiplier
+                            self._add_balance(balances[Fam()], addr, Fam(), asset_balance)
+                for Fam in Fams:
+                    for addr, assets in balances[Fam()].items():
+                        yield Fam, addr, assets
+
+            batcher.record(time.time() - start, len(failed_payloads) > 0)
+            for addr_payload in [payload for payload in addr_payloads if payload in failed_payloads]:
+                # split failed batches until a single address is left, which is then reported as failed
+                if len(addr_payloads[addr_payload]) > 1:
+                    pending.extendleft(reversed(addr_payloads[addr_payload]))
+
+    @staticmethod
+    def _is_grouped(F):
+        return F.group_request_flag and not F.multi_asset_flag
 
     def isempty(self):
         """
@@ -110,101 +266,310 @@ class Portfolio(object):
         """
         return len(self.addr_families) == 0
 
-    def _multi_asset_request(self, F):
+    def iter_refresh(self):
         """
-        multithreaded api requests for addresses that have multiple assets associated with each address e.g. Counterparty
+        generator version of refresh(), yields (family_obj, address, changed) as the balances of each address
+        are loaded from the cache or arrive from the apis, after self.holdings has been updated for that address
+        """
+        self.failed_addresses = {}
+        self.stale_addresses = {}
+        self.markers = {}
+        self.not_modified = {}
+        stale_addrs = {}
+        for Fam in self.addr_families:
+            stale_addrs[Fam()] = []
+            for addr in Fam.addresses:
+                cached = self.cache.get(Fam(), addr, Fam.cache_ttl)
+                if cached is None:
+                    stale_addrs[Fam()].append(addr)
+                else:
+                    yield Fam, addr, self._set_balances(Fam, addr, cached)
+
+        # urls requested for several families, such as families sharing an api, are only requested once
+        flight = singleflight.default_flight
+        flight_coalesced = flight.coalesced
+        shared_urls = self._shared_urls(stale_addrs)
+        flight.share(shared_urls)
+
+        # expired balances which a cheap probe or chain tip check finds unchanged are kept without a full request
+        for Fam in self.addr_families:
+            if Fam.change_method in ('probe', 'tip') and stale_addrs[Fam()]:
+                unchanged_addrs = self._unchanged_addresses(Fam, stale_addrs[Fam()])
+                stale_addrs[Fam()] = [addr for addr in stale_addrs[Fam()] if addr not in unchanged_addrs]
+                for addr in unchanged_addrs:
+                    yield Fam, addr, self._revalidate(Fam, addr)
+
+        received = {Fam(): set() for Fam in self.addr_families}
+        request_streams = [self._group_request(Fams, stale_addrs) for Fams in self._coalesced_group_families()]
+        for Fam in self.addr_families:
+            if stale_addrs[Fam()] and not self._is_grouped(Fam):
+                request_streams.append(self._request(Fam, stale_addrs[Fam()]))
+        for Fam, addr, assets in self._merged(request_streams):
+            self.cache.put(Fam(), addr, assets, marker=self.markers.get(Fam(), {}).get(addr))
+            received[Fam()].add(addr)
+            yield Fam, addr, self._set_balances(Fam, addr, assets)
+
+        for Fam in self.addr_families:
+            for addr in self.not_modified.get(Fam(), ()):
+                received[Fam()].add(addr)
+                yield Fam, addr, self._revalidate(Fam, addr)
+
+        # addresses whose requests failed or ran out of time fall back to the last balances cached for them
+        for Fam in self.addr_families:
+            failed_addrs = [addr for addr in stale_addrs[Fam()] if addr not in received[Fam()]]
+            if failed_addrs:
+                self.failed_addresses[Fam()] = failed_addrs
+            for addr in failed_addrs:
+                last_known = self.cache.last_known(Fam(), addr)
+                if last_known is not None:
+                    self.stale_addresses.setdefault(Fam(), {})[addr] = last_known[0]
+                    yield Fam, addr, self._set_balances(Fam, addr, last_known[1])
+
+        flight.release(shared_urls)
+        self.shared_requests = flight.coalesced - flight_coalesced
+        self.cache.evict({Fam(): Fam.addresses for Fam in self.addr_families})
+        self.cache.save()
+
+    @staticmethod
+    def _merged(streams):
+        """
+        yields the items of every stream of streams as they arrive, each stream is consumed in its own thread so a
+        slow api host does not hold up the others, until every stream is exhausted or the run deadline has passed
+        the first error raised by a stream is raised again once the other streams are done
         """
         q = Queue()
-        threads = []
-        for addr in F.addresses:
-            threads.append(Thread(target=util.api_call, args=(F.api_base, addr, q)))
-            threads[-1].start()
-        [t.join() for t in threads]
-        while not q.empty():
-            addr, json_resp = q.get()
-            resp = util.json_value_by_key(json_resp, F.data_key)
+        errors = []
+
+        def consume(stream):
+            try:
+                [q.put(item) for item in stream]
+            except Exception as e:
+                errors.append(e)
+            finally:
+                q.put(None)
+
+        [Thread(target=consume, args=(stream,), daemon=True).start() for stream in streams]
+        yield from fetch.iter_until_deadline(q, scheduler.default_scheduler.deadline, len(streams))
+        if errors:
+            raise errors[0]
+
+    def missing_addresses(self):
+        """
+        returns list of addresses with a failed family request and no last known balances to fall back to
+        """
+        missing = []
+        for family, addr_lst in self.failed_addresses.items():
+            missing.extend(addr for addr in addr_lst
+                           if addr not in self.stale_addresses.get(family, {}) and addr not in missing)
+        return missing
+
+    @profiler.default_profiler.timed()
+    def _multi_asset_request(self, F, addresses):
+        """
+        concurrent api requests for addresses that have multiple assets associated with each address e.g. Counterparty
+        yields (address, {asset_name:balance, }) as responses arrive
+        """
+        for addr, json_resp in self._fetch(F, addresses):
+            # addresses without any assets are still yielded so they can be cached
+            balances = {addr: {}}
+            resp = F.get_data(json_resp)
             for asset_data in resp:
-                asset_name = util.json_value_by_key(asset_data, F.id_key)
-                asset_balance = util.json_value_by_key(asset_data, F.balance_key) * F.multiplier
-                self._update_balance(addr, asset_name, asset_balance)
+                asset_name = F.get_id(asset_data)
+                asset_balance = F.get_balance(asset_data) * F.multiplier
+                self._add_balance(balances, addr, asset_name, asset_balance)
+            yield addr, balances[addr]
+
+    def refresh(self):
+        """
+        requests balances for every address whose cached balance is missing or expired and updates
+        self.holdings where holdings changed, returns set of addresses whose holdings changed
+        addresses whose requests fail keep their previous balances
+        """
+        return {addr for Fam, addr, changed in self.iter_refresh() if changed}
 
-    def retrieve_asset_prices(self, base_currency):
+    def _request(self, F, addresses):
+        """
+        yields (family_obj, address, {asset_name:balance, }) from the api request strategy of F
+        """
+        if F.multi_asset_flag:
+            request_stream = self._multi_asset_request(F, addresses)
+        elif F.group_request_flag:
+            request_stream = ((addr, assets) for Fam, addr, assets in self._group_request([F], {F(): addresses}))
+        else:
+            request_stream = self._standard_request(F, addresses)
+        for addr, assets in request_stream:
+            yield F, addr, assets
+
+    def _revalidate(self, F, addr):
+        """
+        keeps the cached balances of addr of family F after a change check found them unchanged, returns true if
+        they differ from the balances currently held for addr
+        """
+        self.cache.touch(F(), addr)
+        return self._set_balances(F, addr, self.cache.get(F(), addr, float('inf')))
+
+    @profiler.default_profiler.timed()
+    def retrieve_asset_prices(self, base_currencies, snapshot_file=None, refresh=False):
         """
         initializes asset.Prices() objects and initilizes self.asset_prices with {asset_name:btc_denominated_price}
+        for one or more base_currencies as described in apply_prices()
+        snapshot_file and refresh are passed through to asset.Prices(), which only keeps tickers of the filtered
+        assets and base currencies
         """
-        base_currency = base_currency.upper()
-        AP = asset.Prices()
-        for asset_name in self.unique_assets:
-            price = AP.get(asset_name, base_currency)
-            self.asset_prices[asset_name] = price
+        assets = self.unique_assets | set(util.currency_list(base_currencies))
+        self.prices = asset.Prices(snapshot_file, refresh=refresh, assets=assets)
+        self.apply_prices(base_currencies)
 
-    def _standard_request(self, F):
+    def _set_balances(self, F, addr, assets):
         """
-        multithreaded api requests for addresses that have a single asset and whose api has limit of one address per call
+        stores {asset_name:balance, } of family F for addr and rewrites the rows of addr in self.holdings with its
+        balances combined over every family if they changed, returns true if they changed
         """
-        q = Queue()
-        threads = []
-        for addr in F.addresses:
-            threads.append(Thread(target=util.api_call, args=(F.api_base, addr, q)))
-            threads[-1].start()
-        [t.join() for t in threads]
-        while not q.empty():
-            addr, json_resp = q.get()
-            resp = util.json_value_by_key(json_resp, F.data_key)[0]
+        fam_balances = self.family_balances.setdefault(F(), {})
+        if fam_balances.get(addr) == assets:
+            return False
+        fam_balances[addr] = assets
+
+        addr_balances = {}
+        for Fam in self.addr_families:
+            for asset_name, balance in self.family_balances.get(Fam(), {}).get(addr, {}).items():
+                self._add_balance(addr_balances, addr, asset_name, balance)
+        self.holdings.set_address(addr, addr_balances.get(addr, {}))
+        return True
+
+    @profiler.default_profiler.timed()
+    def _shared_urls(self, family_addrs):
+        """
+        returns list of the urls util.api_call requests for the addresses of family_addrs {family:[address, ], },
+        holding a url once for each time it is requested, for the change checks and balances of every family
+        conditional etag requests are left out, as are grouped requests whose families already share their batches
+        """
+        urls = []
+        for Fam in self.addr_families:
+            addresses = family_addrs[Fam()]
+            if not addresses:
+                continue
+            if Fam.change_method == 'tip':
+                urls.append(Fam.change_check['API'] + Fam.change_check.get('PATH', ''))
+            elif Fam.change_method == 'probe':
+                urls.extend(Fam.change_check['API'] + addr for addr in self._probed_addresses(Fam, addresses))
+            if not self._is_grouped(Fam) and (self.threaded or Fam.change_method != 'etag'):
+                urls.extend(Fam.api_base + addr for addr in addresses)
+        return urls
+
+    def _probed_addresses(self, F, addresses):
+        """
+        returns the addresses of probe family F worth probing, those with cached balances, a probe of an address
+        without a cached marker only stores the marker for its next fetch, addresses never fetched before go
+        straight to their full balance request
+        """
+        return [addr for addr in addresses if self.cache.has(F(), addr)]
+
+    def _standard_request(self, F, addresses):
+        """
+        concurrent api requests for addresses that have a single asset and whose api has limit of one address per call
+        yields (address, {asset_name:balance, }) as responses arrive
+        """
+        for addr, json_resp in self._fetch(F, addresses):
+            resp = F.get_data(json_resp)[0]
             asset_name = F()
-            asset_balance = util.json_value_by_key(resp, F.balance_key) * F.multiplier
-            self._update_balance(addr, asset_name, asset_balance)
+            asset_balance = F.get_balance(resp) * F.multiplier
+            yield addr, {asset_name: Decimal(asset_balance)}
 
-    def _update_balance(self, addr, asset_name, asset_balance):
+    def _unchanged_addresses(self, F, addresses):
         """
-        updates self.addr_assets[addr][asset_name] with asset_balance or creates asset_name for addr
-        with value asset_balance if it does not exist
+        returns set of addresses of probe or tip family F whose change check marker matches the marker cached with
+        their balances, the new markers of every other address are kept in self.markers to be cached once fetched
+        a probe requests CHANGE_CHECK API + address for each address with cached balances, a tip requests
+        CHANGE_CHECK API + PATH once
         """
-        asset_balance = Decimal(asset_balance)
-        if asset_name in self.addr_assets[addr]:
-            self.addr_assets[addr][asset_name].balance += asset_balance
+        if F.change_method == 'tip':
+            tip_resp = util.api_call(F.change_check['API'], F.change_check.get('PATH', ''))
+            check_resps = [] if tip_resp is None else [util.ApiResponse(addr, tip_resp) for addr in addresses]
         else:
-            self.addr_assets[addr][asset_name] = Asset(asset_balance)
+            check_resps = self.engine.iter_fetch(F.change_check['API'], self._probed_addresses(F, addresses),
+                                                 F.max_concurrency)
+
+        unchanged_addrs = set()
+        for addr, check_resp in check_resps:
+            try:
+                marker = F.get_marker(check_resp)
+            except (KeyError, IndexError, TypeError):
+                # a check response without the marker counts as changed
+                continue
+            cached_marker = self.cache.marker(F(), addr)
+            if cached_marker is not None and cached_marker == marker:
+                unchanged_addrs.add(addr)
+            else:
+                self.markers.setdefault(F(), {})[addr] = marker
+        return unchanged_addrs
+
+    def format_address(self, addr, family=None):
+        """
+        returns addr followed by its family if given and, if its balances are stale, the time they were fetched
+        """
+        labels = [family] if family else []
+        fetch_times = [stale[addr] for stale in self.stale_addresses.values() if addr in stale]
+        if fetch_times:
+            labels.append('stale, fetched {0}'.format(
+                    datetime.fromtimestamp(min(fetch_times), timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')))
+        return '{0} ({1})'.format(addr, ', '.join(labels)) if labels else addr
 
+    def format_line(self, asset_name, fill, balance, asset_values, asset_prec_digits, value_prec_digits):
+        """
+        returns dot filled balance line followed by one value column per base currency, columns are labelled
+        with their base currency when there is more than one
+        """
+        value_prec = Decimal('1.{0}'.format('0'*value_prec_digits))
+        value_columns = []
+        for base_currency, asset_value in zip(self.base_currencies, asset_values):
+            value_column = '{0:.{val_prec}f}'.format(Decimal(asset_value).quantize(value_prec), val_prec=value_prec_digits)
+            if len(self.base_currencies) > 1:
+                value_column += ' ' + base_currency
+            value_columns.append(value_column)
+        return '{0}{1}{2:.{asset_prec}f} = {3}'.format(asset_name, fill, balance, '  '.join(value_columns),
+                                                       asset_prec=asset_prec_digits)
+
+    @profiler.default_profiler.timed()
     def print_address_balances(self, asset_prec_digits, value_prec_digits):
         """
         prints itemized asset balances for each address
         """
         value_prec_digits = int(value_prec_digits)
         asset_prec = '1.{0}'.format('0'*asset_prec_digits)
-        value_prec = '1.{0}'.format('0'*value_prec_digits)
 
         longest_width = 0
         fmt_addr_assets = {}
-        for addr, asset_data in self.filtered_addr_assets.items():
+        for addr, asset_data in self.address_balances().items():
             fmt_addr_assets[addr] = {}
-            for asset_name, asset_obj in asset_data.items():
-                asset_obj.balance = asset_obj.balance.quantize(Decimal(asset_prec))
-                fmt_addr_assets[addr][asset_name] = asset_obj
+            for asset_name, balance in asset_data.items():
+                balance = balance.quantize(Decimal(asset_prec))
+                fmt_addr_assets[addr][asset_name] = balance
 
-                width = len('{0}{1}'.format(asset_name, asset_obj.balance))
+                width = len('{0}{1}'.format(asset_name, balance))
                 if width > longest_width:
                     longest_width = width
 
         for addr, asset_data in fmt_addr_assets.items():
-            print(addr)
-            for asset_name, asset_obj in asset_data.items():
-                line_width = len('{0}{1}'.format(asset_name, asset_obj.balance))
+            print(self.format_address(addr))
+            for asset_name, balance in asset_data.items():
+                line_width = len('{0}{1}'.format(asset_name, balance))
                 fill = '.' * (longest_width-line_width+5)
-                asset_value = Decimal(asset_obj.balance * self.asset_prices[asset_name]).quantize(Decimal(value_prec))
-
-                print('{0}{1}{2:.{asset_prec}f} = {3:.{val_prec}f}'.format(
-                        asset_name, fill, asset_obj.balance, asset_value,
-                        asset_prec=asset_prec_digits, val_prec=value_prec_digits))
+                asset_values = self.asset_values(asset_name, balance)
+                print(self.format_line(asset_name, fill, balance, asset_values,
+                                        asset_prec_digits, value_prec_digits))
+            print()
+        for addr in self.missing_addresses():
+            print('{0} (missing)'.format(addr))
             print()
 
+    @profiler.default_profiler.timed()
     def print_total_balances(self, asset_prec_digits, value_prec_digits):
         """
         prints combined asset totals from all address asset balances
         """
         value_prec_digits = int(value_prec_digits)
         asset_prec = '1.{0}'.format('0'*asset_prec_digits)
-        value_prec = '1.{0}'.format('0'*value_prec_digits)
 
         asset_totals = self.get_asset_totals()
         fmt_asset_totals = {}
@@ -221,13 +586,33 @@ class Portfolio(object):
         for asset_name, balance in fmt_asset_totals.items():
             line_width = len('{0}{1}'.format(asset_name, balance))
             fill = '.' * (longest_width-line_width+5)
-            asset_value = Decimal(balance * self.asset_prices[asset_name]).quantize(Decimal(value_prec))
-
-            print('{0}{1}{2:.{asset_prec}f} = {3:.{val_prec}f}'.format(
-                    asset_name, fill, balance, asset_value,
-                    asset_prec=asset_prec_digits, val_prec=value_prec_digits))
-
-
-
+            asset_values = self.asset_values(asset_name, balance)
+            print(self.format_line(asset_name, fill, balance, asset_values, asset_prec_digits, value_prec_digits))
 
+    @profiler.default_profiler.timed()
+    def write_address_balances(self, fmt, asset_prec_digits, value_prec_digits, out=sys.stdout):
+        """
+        streams an address, asset, balance, value per base currency and status row for each filtered address asset
+        to out in fmt, 'jsonl' or 'csv', in a single pass without altering any balance, followed by a row with only
+        an address and a 'missing' status for each address in missing_addresses()
+        """
+        W = writers.writer(fmt, out, self.base_currencies, itemize=True)
+        for addr, asset_data in self.address_balances().items():
+            status = self.address_status(addr)
+            for asset_name, balance in asset_data.items():
+                asset_values = self.asset_values(asset_name, balance)
+                W.write([addr] + writers.balance_row(asset_name, balance, asset_values,
+                                                     asset_prec_digits, value_prec_digits) + [status])
+        [W.write(writers.missing_row(addr, self.base_currencies)) for addr in self.missing_addresses()]
 
+    @profiler.default_profiler.timed()
+    def write_total_balances(self, fmt, asset_prec_digits, value_prec_digits, out=sys.stdout):
+        """
+        streams an asset, balance and value per base currency row for each combined asset total to out
+        in fmt, 'jsonl' or 'csv'
+        """
+        W = writers.writer(fmt, out, self.base_currencies)
+        asset_values = self.get_asset_values()
+        for asset_name, balance in self.get_asset_totals().items():
+            W.write(writers.balance_row(asset_name, balance, asset_values[asset_name], asset_prec_digits,
+                                         value_prec_digits))
@@ -0,0 +1,170 @@
+import json
+import time
+import inspect
+import functools
+import threading
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+
+# upper bounds in milliseconds of the per family request latency histogram buckets
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+_NULL_SPAN = nullcontext()
+
+class _Span(object):
+    def __init__(self, profiler, name, cat, args):
+        self.profiler = profiler
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_event(self.name, self.cat, self.start, time.perf_counter() - self.start, self.args)
+
+class Profiler(object):
+    def __init__(self):
+        """
+        records timed spans and api requests while enabled, disabled it only costs an attribute check per call
+        """
+        self.enabled = False
+        self.events = []
+        self.requests = []
+        # {api_base:family_name, } so request latencies can be grouped by address family
+        self.families = {}
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_event(self, name, cat, start, duration, args=None):
+        """
+        records a complete chrome trace event which started at perf_counter() time start and lasted duration seconds
+        """
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': 1, 'tid': threading.get_ident(),
+                 'ts': round((start - self.origin) * 1e6, 1), 'dur': round(duration * 1e6, 1), 'args': args or {}}
+        with self._lock:
+            self.events.append(event)
+
+    def enable(self):
+        self.enabled = True
+        self.origin = time.perf_counter()
+
+    def family(self, url):
+        """
+        returns the family name labelled for the longest api_base that url starts with, or the host of url
+        """
+        matches = [api_base for api_base in self.families if url.startswith(api_base)]
+        if matches:
+            return self.families[max(matches, key=len)]
+        return urlsplit(url).netloc
+
+    def histograms(self):
+        """
+        returns {family:{'count', 'failed', 'bytes', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms', 'buckets'}, } of the
+        recorded requests, buckets maps each bucket upper bound in milliseconds to the number of requests in it
+        """
+        family_latencies = {}
+        stats = {}
+        for req in self.requests:
+            family_latencies.setdefault(req['family'], []).append(req['latency_ms'])
+            family_stats = stats.setdefault(req['family'], {'count': 0, 'failed': 0, 'bytes': 0})
+            family_stats['count'] += 1
+            family_stats['failed'] += req['failed']
+            family_stats['bytes'] += req['bytes']
+
+        for family, latencies in family_latencies.items():
+            latencies.sort()
+            buckets = {str(bound): 0 for bound in LATENCY_BUCKETS_MS}
+            buckets['inf'] = 0
+            for latency in latencies:
+                bound = next((bound for bound in LATENCY_BUCKETS_MS if latency <= bound), 'inf')
+                buckets[str(bound)] += 1
+            stats[family].update({'mean_ms': round(sum(latencies) / len(latencies), 3),
+                                  'p50_ms': latencies[len(latencies) // 2],
+                                  'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                                  'max_ms': latencies[-1],
+                                  'buckets': buckets})
+        return stats
+
+    def label(self, api_base, family):
+        """
+        labels requests to api_base with family, families sharing an api_base are labelled together
+        """
+        with self._lock:
+            labels = self.families.get(api_base, '').split('/')
+            if family not in labels:
+                self.families[api_base] = '/'.join([label for label in labels if label] + [family])
+
+    def record_request(self, url, start, nbytes, failed=False):
+        """
+        records a request to url which started at perf_counter() time start and received nbytes
+        """
+        if not self.enabled:
+            return
+        duration = time.perf_counter() - start
+        family = self.family(url)
+        with self._lock:
+            self.requests.append({'url': url, 'family': family, 'latency_ms': round(duration * 1e3, 3),
+                                  'bytes': nbytes, 'failed': failed})
+        self.add_event(urlsplit(url).path, 'request', start, duration,
+                       {'family': family, 'bytes': nbytes, 'failed': failed})
+
+    def span(self, name, cat='stage', **args):
+        """
+        returns a context manager which records the time spent inside it as an event
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def stage_timings(self):
+        """
+        returns {stage_name:{'calls', 'total_ms'}, } summed over the recorded stage events
+        """
+        stages = {}
+        for event in self.events:
+            if event['cat'] == 'stage':
+                stage = stages.setdefault(event['name'], {'calls': 0, 'total_ms': 0.0})
+                stage['calls'] += 1
+                stage['total_ms'] = round(stage['total_ms'] + event['dur'] / 1e3, 3)
+        return stages
+
+    def timed(self, name=None, cat='stage'):
+        """
+        decorator recording each call of the decorated function as an event, for generator functions the event
+        lasts from the first item being requested until the generator is exhausted or closed
+        """
+        def decorator(fn):
+            span_name = name or fn.__qualname__
+
+            if inspect.isgeneratorfunction(fn):
+                @functools.wraps(fn)
+                def timed_generator(*args, **kwargs):
+                    with self.span(span_name, cat):
+                        yield from fn(*args, **kwargs)
+                return timed_generator
+
+            @functools.wraps(fn)
+            def timed_function(*args, **kwargs):
+                with self.span(span_name, cat):
+                    return fn(*args, **kwargs)
+            return timed_function
+        return decorator
+
+    def write(self, file_path):
+        """
+        writes the recorded events to file_path in the chrome trace json object format, along with the recorded
+        requests, per family latency histograms and per stage timings
+        """
+        with self._lock:
+            trace = {'traceEvents': list(self.events),
+                     'displayTimeUnit': 'ms',
+                     'requests': list(self.requests)}
+        trace['families'] = self.histograms()
+        trace['stages'] = self.stage_timings()
+        with open(file_path, 'w') as f:
+            json.dump(trace, f, indent=1)
+
+default_profiler = Profiler()
@@ -0,0 +1,273 @@
+import sys
+import time
+import statistics
+from queue import Queue, Empty
+from threading import Lock, Thread
+from decimal import Decimal
+
+from src import util, scheduler
+
+ASSET_CLASSES = ['CRYPTOCURRENCY', 'FIAT']
+MODES = ['hedged', 'median']
+# seconds to wait on the fastest provider of an asset class before also asking the next fastest one
+DEFAULT_HEDGE_DELAY = 2
+# seconds to wait for an answer, in median mode for the answers of every provider
+DEFAULT_DEADLINE = 20
+# weight of the latest fetch time in the moving average latency of a provider
+LATENCY_WEIGHT = 0.3
+# providers of each asset class, overridden per asset class by src/price_config.json
+DEFAULT_CONFIG = {
+    'CRYPTOCURRENCY': {'MODE': 'hedged',
+                       'PROVIDERS': [{'NAME': 'cryptocoincharts',
+                                      'API': 'http://api.cryptocoincharts.info/',
+                                      'PATH': 'listCoins',
+                                      'SYMBOL_KEY': ['id'],
+                                      'NAME_KEY': ['name'],
+                                      'PRICE_KEY': ['price_btc']}]},
+    'FIAT': {'MODE': 'hedged',
+             'PROVIDERS': [{'NAME': 'bitcoincharts',
+                            'API': 'http://api.bitcoincharts.com/v1/',
+                            'PATH': 'markets.json',
+                            'SYMBOL_KEY': ['currency'],
+                            'PRICE_KEY': ['bid']}]}}
+
+class PriceFeedError(Exception):
+    pass
+
+class PriceProvider(object):
+    def __init__(self, conf):
+        """
+        price feed answering a json array of tickers at API + PATH, each ticker holding its price in BTC at
+        PRICE_KEY, its symbol at SYMBOL_KEY and, if NAME_KEY is set, its name at NAME_KEY
+        the optional TIMEOUT and RETRIES of conf set the request limits of the feed's api host
+        providers of other feed formats subclass PriceProvider, override tickers() and are added to PROVIDER_TYPES
+        """
+        self.name = conf['NAME']
+        self.api_base = conf['API']
+        self.api_path = conf.get('PATH', '')
+        self.symbol_getter = util.compile_key_path(conf['SYMBOL_KEY'])
+        self.name_getter = util.compile_key_path(conf['NAME_KEY']) if conf.get('NAME_KEY') else None
+        self.price_getter = util.compile_key_path(conf['PRICE_KEY'])
+        # moving average seconds of successful fetches, None until the first one
+        self.latency = None
+        # consecutive failed fetches, a provider is healthy again after its next successful fetch
+        self.failures = 0
+        scheduler.default_scheduler.configure(self.api_base, timeout=conf.get('TIMEOUT', scheduler.DEFAULT_TIMEOUT),
+                                              retries=conf.get('RETRIES', scheduler.DEFAULT_RETRIES))
+
+    def fetch(self, assets=None):
+        """
+        returns ({symbol:btc_price, }, {name:btc_price, }) of the tickers of the feed with a price, skipping tickers
+        whose symbol and name are both missing from assets when assets is not None
+        raises PriceFeedError if the request fails or the feed holds no tickers
+        """
+        symbols, names = {}, {}
+        ticker_count = 0
+        try:
+            for symbol, name, price in self.tickers():
+                ticker_count += 1
+                symbol = symbol.upper()
+                name = name.upper() if name else None
+                if assets is not None and symbol not in assets and name not in assets:
+                    continue
+                btc_price = Decimal(price) if price else 0
+                if btc_price > 0:
+                    symbols[symbol] = btc_price
+                    if name:
+                        names[name] = btc_price
+        except Exception as e:
+            raise PriceFeedError('{0} failed: {1}'.format(self.name, e))
+        if not ticker_count:
+            raise PriceFeedError('{0} returned no tickers'.format(self.name))
+        return symbols, names
+
+    def healthy(self):
+        return self.failures == 0
+
+    def record(self, seconds, failed=False):
+        """
+        records a fetch which took seconds, only successful fetches count towards the latency
+        """
+        if failed:
+            self.failures += 1
+        else:
+            self.failures = 0
+            self.latency = seconds if self.latency is None else (
+                    LATENCY_WEIGHT * seconds + (1 - LATENCY_WEIGHT) * self.latency)
+
+    def tickers(self):
+        """
+        yields (symbol, name, btc_price) of each ticker of the feed as it is decoded, name is None without NAME_KEY
+        """
+        for ticker in util.iter_api_array(self.api_base, self.api_path, raise_errors=True):
+            yield (self.symbol_getter(ticker), self.name_getter(ticker) if self.name_getter else None,
+                   self.price_getter(ticker))
+
+PROVIDER_TYPES = {'json_array': PriceProvider}
+
+class ProviderRegistry(object):
+    def __init__(self, conf=DEFAULT_CONFIG):
+        """
+        price providers of each asset class with the latency of each provider, fetched either hedged, asking
+        the fastest healthy provider first and the next one too whenever HEDGE_DELAY seconds pass without a good
+        answer, or in median mode, asking every provider at once and taking the median price of each ticker from
+        the providers answering within DEADLINE seconds
+        """
+        self.asset_classes = {}
+        self._lock = Lock()
+        self.configure(conf)
+
+    def configure(self, conf):
+        """
+        sets the mode and providers of each asset class in conf, {asset_class:{'MODE', 'HEDGE_DELAY', 'DEADLINE',
+        'PROVIDERS':[{'NAME', 'TYPE', ...}, ]}, }, asset classes missing from conf keep their providers and
+        providers keeping their NAME keep their latency
+        """
+        with self._lock:
+            for asset_class, class_conf in conf.items():
+                asset_class = asset_class.upper()
+                if asset_class not in ASSET_CLASSES:
+                    raise ValueError('Unknown asset class {0}, expected one of {1}'.format(asset_class,
+                                                                                        ', '.join(ASSET_CLASSES)))
+                mode = class_conf.get('MODE', 'hedged')
+                if mode not in MODES:
+                    raise ValueError('Unknown price provider mode {0} for {1}, expected one of {2}'.format(
+                            mode, asset_class, ', '.join(MODES)))
+                known = {P.name: P for P in self.asset_classes.get(asset_class, {}).get('providers', [])}
+                providers = []
+                for provider_conf in class_conf['PROVIDERS']:
+                    P = PROVIDER_TYPES[provider_conf.get('TYPE', 'json_array')](provider_conf)
+                    if P.name in known:
+                        P.latency, P.failures = known[P.name].latency, known[P.name].failures
+                    providers.append(P)
+                self.asset_classes[asset_class] = {
+                        'mode': mode,
+                        'hedge_delay': float(class_conf.get('HEDGE_DELAY', DEFAULT_HEDGE_DELAY)),
+                        'deadline': float(class_conf.get('DEADLINE', DEFAULT_DEADLINE)),
+                        'providers': providers}
+
+    @staticmethod
+    def _deadline(settings):
+        """
+        returns the time.monotonic() time to stop waiting for the providers of settings, at most the deadline of
+        scheduler.default_scheduler
+        """
+        remaining = scheduler.default_scheduler.remaining()
+        return time.monotonic() + (settings['deadline'] if remaining is None else min(settings['deadline'], remaining))
+
+    def fetch(self, asset_class, assets=None):
+        """
+        returns ({symbol:btc_price, }, {name:btc_price, }) of asset_class from its providers as in
+        PriceProvider.fetch(), or None if no provider answered in time, which is reported on stderr
+        """
+        settings = self.asset_classes[asset_class]
+        if settings['mode'] == 'median':
+            result = self._fetch_median(settings, assets)
+        else:
+            result = self._fetch_hedged(settings, assets)
+        if result is None:
+            print('No price provider for {0} answered'.format(asset_class.lower()), file=sys.stderr)
+        return result
+
+    def _fetch_hedged(self, settings, assets):
+        """
+        returns the first good answer of the providers of settings, started fastest first, each after the previous
+        one failed or went hedge_delay seconds without answering
+        """
+        providers = self.ranked(settings['providers'])
+        answers = Queue()
+        deadline = self._deadline(settings)
+        started = pending = 0
+        hedge_time = 0
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                return None
+            if started < len(providers) and (pending == 0 or now >= hedge_time):
+                self._start(providers[started], assets, answers)
+                started += 1
+                pending += 1
+                hedge_time = now + settings['hedge_delay']
+                continue
+            if pending == 0:
+                return None
+            wait_until = deadline if started == len(providers) else min(deadline, hedge_time)
+            try:
+                result = answers.get(timeout=wait_until - now)
+            except Empty:
+                continue
+            pending -= 1
+            if result is not None:
+                return result
+
+    def _fetch_median(self, settings, assets):
+        """
+        returns the median price of each ticker over the providers of settings answering within the deadline
+        """
+        providers = settings['providers']
+        answers = Queue()
+        deadline = self._deadline(settings)
+        [self._start(P, assets, answers) for P in providers]
+        results = []
+        for i in range(len(providers)):
+            try:
+                result = answers.get(timeout=max(0, deadline - time.monotonic()))
+            except Empty:
+                break
+            if result is not None:
+                results.append(result)
+        if not results:
+            return None
+        return tuple(median_prices([result[i] for result in results]) for i in range(2))
+
+    def load_stats(self, stats):
+        """
+        sets the latency and failures of providers without a latency from stats as returned by stats()
+        """
+        for settings in self.asset_classes.values():
+            for P in settings['providers']:
+                if P.latency is None and P.name in stats:
+                    P.latency, P.failures = stats[P.name]
+
+    @staticmethod
+    def ranked(providers):
+        """
+        returns providers ordered healthy first, then by latency with providers not yet timed after the timed ones,
+        keeping the configured order between equals
+        """
+        return sorted(providers, key=lambda P: (not P.healthy(), P.latency is None, P.latency or 0))
+
+    def _start(self, P, assets, answers):
+        """
+        fetches the prices of provider P in a daemon thread, putting the result or None if it failed into answers
+        a provider left running once an answer was chosen still records its latency when it finishes
+        """
+        def run():
+            start = time.perf_counter()
+            try:
+                result = P.fetch(assets)
+            except PriceFeedError as e:
+                print('Price provider {0}'.format(e), file=sys.stderr)
+                result = None
+            P.record(time.perf_counter() - start, failed=result is None)
+            answers.put(result)
+        Thread(target=run, daemon=True).start()
+
+    def stats(self):
+        """
+        returns {provider_name:(latency, failures), } of every provider
+        """
+        return {P.name: (P.latency, P.failures)
+                for settings in self.asset_classes.values() for P in settings['providers']}
+
+def median_prices(price_dicts):
+    """
+    returns {key:price} holding the median of the prices of each key over the dicts of price_dicts holding it
+    """
+    prices = {}
+    for price_dict in price_dicts:
+        for key, price in price_dict.items():
+            prices.setdefault(key, []).append(price)
+    return {key: statistics.median(key_prices) for key, key_prices in prices.items()}
+
+default_registry = ProviderRegistry()
@@ -0,0 +1,168 @@
+import time
+import random
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+# status codes worth retrying, anything else >= 400 fails straight away
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# share of a run deadline by the end of which each stage has to be done, rendering gets whatever is left
+DEADLINE_STAGES = {'fetch': 0.6, 'prices': 0.85, 'render': 1.0}
+
+class ApiError(Exception):
+    pass
+
+class DeadlineExceeded(ApiError):
+    pass
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=1):
+        """
+        allows on average rate acquisitions per second with bursts of up to burst acquisitions
+        """
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        """
+        blocks until a token is available and takes it
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class HostPolicy(object):
+    def __init__(self, rate=None, burst=1, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+        """
+        request limits for a single api host, a rate of None leaves requests to the host unthrottled
+        """
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.timeout = timeout
+        self.retries = retries
+
+class RunDeadline(object):
+    def __init__(self, seconds, start=None):
+        """
+        deadline of a whole run seconds after start, split between the fetch, prices and render stages by
+        DEADLINE_STAGES so a slow stage leaves the later ones their share
+        """
+        self.seconds = float(seconds)
+        self.start = time.monotonic() if start is None else start
+
+    def enter(self, stage, request_scheduler=None):
+        """
+        limits the requests of request_scheduler, default_scheduler unless given, to the end of stage
+        """
+        (request_scheduler or default_scheduler).deadline = self.stage_end(stage)
+
+    def stage_end(self, stage):
+        """
+        returns the time.monotonic() time by which stage has to be done
+        """
+        return self.start + self.seconds * DEADLINE_STAGES[stage]
+
+class RequestScheduler(object):
+    def __init__(self):
+        """
+        makes requests through a per host token bucket, retrying timeouts, connection errors and throttled or
+        failed responses with jittered exponential backoff
+        if self.deadline, a time.monotonic() time, is set no request is started or retried after it and the timeout
+        of every request is cut to the time left
+        """
+        self.policies = {}
+        self.deadline = None
+        self._lock = Lock()
+
+    def configure(self, api_base, rate=None, burst=1, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+        """
+        sets the request limits of the host of api_base, the first configuration of a host is kept so families
+        sharing an api host share one token bucket
+        """
+        host = urlsplit(api_base).netloc
+        with self._lock:
+            if host not in self.policies:
+                self.policies[host] = HostPolicy(rate, burst, timeout, retries)
+            return self.policies[host]
+
+    def expired(self):
+        return self.remaining() == 0
+
+    def policy(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.policies:
+                self.policies[host] = HostPolicy()
+            return self.policies[host]
+
+    def request(self, url, getter=requests.get):
+        """
+        returns the successful requests.Response for url fetched with getter, raises ApiError once every
+        retry has failed and DeadlineExceeded if the deadline passes first
+        """
+        policy = self.policy(url)
+        error = None
+        for attempt in range(policy.retries + 1):
+            if attempt > 0:
+                delay = backoff_delay(attempt, error)
+                if self.deadline is not None and time.monotonic() + delay >= self.deadline:
+                    raise DeadlineExceeded('{0} ran out of time after {1} attempts'.format(url, attempt))
+                time.sleep(delay)
+            if policy.bucket:
+                policy.bucket.acquire()
+            if self.expired():
+                raise DeadlineExceeded('{0} ran out of time after {1} attempts'.format(url, attempt))
+            timeout = policy.timeout if self.deadline is None else min(policy.timeout, max(0.001, self.remaining()))
+            try:
+                resp = getter(url, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                continue
+            if resp.status_code in RETRY_STATUS_CODES:
+                error = resp
+                continue
+            if resp.status_code >= 400:
+                raise ApiError('{0} returned status {1}'.format(url, resp.status_code))
+            return resp
+        if isinstance(error, requests.Response):
+            raise ApiError('{0} returned status {1} after {2} attempts'.format(url, error.status_code, attempt + 1))
+        raise ApiError('{0} failed after {1} attempts: {2}'.format(url, attempt + 1, error))
+
+    def remaining(self):
+        """
+        returns seconds left until self.deadline, or None without a deadline
+        """
+        return seconds_left(self.deadline)
+
+def backoff_delay(attempt, error=None):
+    """
+    returns seconds to wait before retry number attempt, a Retry-After header on a throttled response is honoured
+    otherwise the delay is drawn uniformly from [0, BACKOFF_BASE * 2^attempt] capped at BACKOFF_MAX
+    """
+    if isinstance(error, requests.Response):
+        retry_after = error.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(BACKOFF_MAX, int(retry_after))
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def seconds_left(deadline):
+    """
+    returns seconds left until deadline, a time.monotonic() time, or None if deadline is None
+    """
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+default_scheduler = RequestScheduler()
@@ -0,0 +1,165 @@
+import os
+import glob
+import zlib
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
+
+from src import util
+
+PARTIAL_FILE = 'partial-{0:04d}-of-{1:04d}.json'
+# balance cache of a shard, written next to the main balance cache
+SHARD_CACHE_FILE = '{0}.shard{1}of{2}'
+
+def evaluate_shard(addr_data, addr_config, shard_index, shard_count, out_dir, threaded=False, cache_file=None):
+    """
+    fetches balances of the addresses of addr_data in shard shard_index of shard_count and writes them to out_dir
+    as a partial result which merge_partials() combines with the other shards, returns the partial file path
+    each shard keeps its own balance cache next to cache_file so shards never overwrite each other's entries, it
+    starts from the entries of cache_file for the shard's addresses and is folded back by merge_caches()
+    the rate limit and concurrency of each family are split between the shards, which share the api hosts
+    """
+    from src import portfolio
+    from src.cache import BalanceCache
+
+    addr_data = shard_addr_data(addr_data, shard_index, shard_count)
+    if cache_file:
+        C = BalanceCache(SHARD_CACHE_FILE.format(cache_file, shard_index, shard_count))
+        C.merge(BalanceCache(cache_file).entries)
+        C.evict({family.upper(): addr_lst for family, addr_lst in addr_data.items()})
+        C.save()
+        cache_file = C.file_path
+    P = portfolio.Portfolio(addr_data, shard_addr_config(addr_config, shard_count), [], threaded, cache_file)
+
+    asset_totals = {}
+    family_balances = {}
+    for family, balances in P.family_balances.items():
+        family_balances[family] = {}
+        for addr, assets in balances.items():
+            family_balances[family][addr] = {asset_name: str(balance) for asset_name, balance in assets.items()}
+            for asset_name, balance in assets.items():
+                asset_totals[asset_name] = asset_totals.get(asset_name, 0) + balance
+
+    partial = {'shard_index': shard_index,
+               'shard_count': shard_count,
+               'family_balances': family_balances,
+               'failed_addresses': P.failed_addresses,
+               'stale_addresses': P.stale_addresses,
+               'asset_totals': {asset_name: str(total) for asset_name, total in asset_totals.items()}}
+    os.makedirs(out_dir, exist_ok=True)
+    partial_file = os.path.join(out_dir, PARTIAL_FILE.format(shard_index, shard_count))
+    # written under a temporary name and renamed so other machines sharing out_dir never read half a partial
+    util.json_to_file(partial_file + '.tmp', partial)
+    os.replace(partial_file + '.tmp', partial_file)
+    return partial_file
+
+def evaluate_sharded(addr_data, addr_config, shard_count, out_dir, threaded=False, cache_file=None):
+    """
+    evaluates every shard of addr_data in its own worker process and returns the list of partial file paths
+    """
+    addr_data = {family: list(addr_lst) for family, addr_lst in addr_data.items()}
+    with ProcessPoolExecutor(max_workers=shard_count) as executor:
+        futures = [executor.submit(evaluate_shard, shard_addr_data(addr_data, shard_index, shard_count), addr_config,
+                                   shard_index, shard_count, out_dir, threaded, cache_file)
+                   for shard_index in range(shard_count)]
+        return [future.result() for future in futures]
+
+def load_partials(out_dir):
+    """
+    returns list of partial results in out_dir, raises ValueError unless they are exactly one complete set of shards
+    """
+    partial_files = sorted(glob.glob(os.path.join(out_dir, 'partial-*.json')))
+    partials = [util.json_from_file(partial_file) for partial_file in partial_files]
+    if not partials:
+        raise ValueError('No partial results found in {0}'.format(out_dir))
+    shard_counts = {partial['shard_count'] for partial in partials}
+    if len(shard_counts) > 1:
+        raise ValueError('Partial results in {0} are from different shard counts {1}'.format(out_dir,
+                                                                                          sorted(shard_counts)))
+    shard_count = shard_counts.pop()
+    missing = sorted(set(range(shard_count)) - {partial['shard_index'] for partial in partials})
+    if missing:
+        raise ValueError('Partial results in {0} are missing shards {1} of {2}'.format(out_dir, missing, shard_count))
+    return partials
+
+def merge_caches(cache_file, family_addrs):
+    """
+    folds the balance cache of every shard, whatever shard count it was written for, into cache_file and removes
+    it, keeping only the addresses of {family:[address, ], }
+    """
+    from src.cache import BalanceCache
+
+    C = BalanceCache(cache_file)
+    shard_cache_files = glob.glob(SHARD_CACHE_FILE.format(glob.escape(cache_file), '*', '*'))
+    for shard_cache_file in shard_cache_files:
+        C.merge(BalanceCache(shard_cache_file).entries)
+    C.evict({family.upper(): list(addr_lst) for family, addr_lst in family_addrs.items()})
+    C.save()
+    [os.remove(shard_cache_file) for shard_cache_file in shard_cache_files]
+
+def merge_partials(P, partials):
+    """
+    fills Portfolio P, created with refresh=False for the whole address set, with the balances of every partial
+    result so that it holds exactly what a single process refresh() would have fetched
+    raises ValueError if the per asset totals of the partials disagree with the merged holdings
+    """
+    family_balances = {}
+    P.failed_addresses = {}
+    P.stale_addresses = {}
+    for partial in partials:
+        for family, balances in partial['family_balances'].items():
+            family_balances.setdefault(family, {}).update(balances)
+        for family, addr_lst in partial['failed_addresses'].items():
+            P.failed_addresses.setdefault(family, []).extend(addr_lst)
+        for family, fetch_times in partial.get('stale_addresses', {}).items():
+            P.stale_addresses.setdefault(family, {}).update(fetch_times)
+
+    # balances are set in the family and address order of P so addresses and assets are ordered as in a single run
+    for Fam in P.addr_families:
+        balances = family_balances.get(Fam(), {})
+        for addr in Fam.addresses:
+            if addr in balances:
+                assets = {asset_name: Decimal(balance) for asset_name, balance in balances[addr].items()}
+                P._set_balances(Fam, addr, assets)
+
+    partial_totals = {}
+    for partial in partials:
+        for asset_name, total in partial['asset_totals'].items():
+            partial_totals[asset_name] = partial_totals.get(asset_name, 0) + Decimal(total)
+    merged_totals = {}
+    for balances in P.family_balances.values():
+        for assets in balances.values():
+            for asset_name, balance in assets.items():
+                merged_totals[asset_name] = merged_totals.get(asset_name, 0) + balance
+    if partial_totals != merged_totals:
+        raise ValueError('Partial results do not match their asset totals, they may hold addresses missing from '
+                         'the address store or come from different runs')
+
+def shard_addr_config(addr_config, shard_count):
+    """
+    returns a copy of addr_config whose RATE_LIMIT and MAX_CONCURRENCY of each family are split evenly between
+    shard_count shards, so the shards together stay within the limits of each api host
+    """
+    from src import fetch
+
+    shard_config = {}
+    for family, conf in addr_config.items():
+        conf = dict(conf)
+        rate, burst = conf.get('RATE_LIMIT') or [None, 1]
+        if rate is not None:
+            conf['RATE_LIMIT'] = [rate / shard_count, max(1, burst // shard_count)]
+        conf['MAX_CONCURRENCY'] = max(1, conf.get('MAX_CONCURRENCY', fetch.DEFAULT_CONCURRENCY) // shard_count)
+        shard_config[family] = conf
+    return shard_config
+
+def shard_addr_data(addr_data, shard_index, shard_count):
+    """
+    returns {family:[address, ], } of the addresses of addr_data which belong to shard shard_index of shard_count
+    """
+    return {family: [addr for addr in addr_lst if shard_of(family, addr, shard_count) == shard_index]
+            for family, addr_lst in addr_data.items()}
+
+def shard_of(family, addr, shard_count):
+    """
+    returns the shard of addr of family, a stable hash so every process and machine agrees on it
+    """
+    return zlib.crc32('{0}:{1}'.format(family.upper(), addr).encode()) % shard_count
@@ -0,0 +1,91 @@
+from threading import Event, Lock
+
+class _Call(object):
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    def __init__(self):
+        """
+        coalesces identical calls, a call whose key is already in flight waits for it and shares its result instead
+        of being made again, and the result of a key expected more than once through share() is kept until every
+        expected call has taken it, so repeats made after the first call finished are not made again either
+        failed calls are never kept, the next call for their key is made afresh
+        """
+        # calls made and calls answered by another call's result
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        # {key:calls still expected, } and {key:result, } of finished keys with calls still expected
+        self._expected = {}
+        self._kept = {}
+        self._lock = Lock()
+
+    def call(self, key, fn, *args):
+        """
+        returns fn(*args) for the first call of key, or the result of the call of key in flight or kept, errors
+        of a shared call are raised in every call waiting on it
+        """
+        with self._lock:
+            self._take_expected(key)
+            if key in self._kept:
+                self.coalesced += 1
+                return self._kept[key] if key in self._expected else self._kept.pop(key)
+            C = self._in_flight.get(key)
+            if C is None:
+                C = self._in_flight[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            C.done.wait()
+            if C.error is not None:
+                raise C.error
+            return C.result
+        try:
+            C.result = fn(*args)
+            return C.result
+        except Exception as e:
+            C.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if C.error is None and key in self._expected:
+                    self._kept[key] = C.result
+            C.done.set()
+
+    def release(self, keys):
+        """
+        forgets the expected calls and kept results of keys, for calls which were expected but never made
+        """
+        with self._lock:
+            for key in keys:
+                self._expected.pop(key, None)
+                self._kept.pop(key, None)
+
+    def share(self, keys):
+        """
+        expects a call for each occurrence of a key in keys, results of keys occurring more than once are kept for
+        their later calls
+        """
+        counts = {}
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        with self._lock:
+            for key, count in counts.items():
+                if count > 1:
+                    self._expected[key] = self._expected.get(key, 0) + count
+
+    def _take_expected(self, key):
+        if key in self._expected:
+            self._expected[key] -= 1
+            if self._expected[key] <= 0:
+                del self._expected[key]
+
+default_flight = SingleFlight()
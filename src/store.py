@@ -0,0 +1,75 @@
+import os
+import sqlite3
+
+from src import util
+
+class AddressStore(object):
+    def __init__(self, db_file, legacy_json_file=None):
+        """
+        indexed sqlite store of {family:[address, ], } where each address is stored once per family
+        addresses from legacy_json_file (the old addresses.json) are imported the first time the store is created
+        """
+        self.db_file = db_file
+        is_new = not os.path.isfile(db_file)
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS addresses ('
+                          'family TEXT NOT NULL, address TEXT NOT NULL, UNIQUE (family, address))')
+        if is_new and legacy_json_file and os.path.isfile(legacy_json_file) and os.path.getsize(legacy_json_file) > 0:
+            legacy_data = util.json_from_file(legacy_json_file)
+            self.bulk_import((family, addr) for family, addr_lst in legacy_data.items() for addr in addr_lst)
+
+    def add(self, family, addr_lst=[]):
+        """
+        adds each address in addr_lst to family, addresses already present are ignored
+        returns number of addresses added
+        """
+        return self.bulk_import((family, addr) for addr in addr_lst)
+
+    def addr_data(self):
+        """
+        returns {family:address_iterator, } where each address iterator lazily reads addresses in the order added
+        """
+        return {family: self.iter_addresses(family) for family in self.families()}
+
+    def bulk_import(self, rows):
+        """
+        adds every (family, address) in rows within a single transaction, duplicates are ignored
+        returns number of addresses added
+        """
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany('INSERT OR IGNORE INTO addresses (family, address) VALUES (?, ?)',
+                                  ((family.upper(), addr.strip()) for family, addr in rows if addr.strip()))
+            return self.conn.total_changes - before
+
+    def close(self):
+        self.conn.close()
+
+    def families(self):
+        """
+        returns list of families with at least one address, in the order they were first added
+        """
+        cursor = self.conn.execute('SELECT family FROM addresses GROUP BY family ORDER BY MIN(rowid)')
+        return [row[0] for row in cursor]
+
+    def has_family(self, family):
+        cursor = self.conn.execute('SELECT 1 FROM addresses WHERE family = ? LIMIT 1', (family.upper(),))
+        return cursor.fetchone() is not None
+
+    def iter_addresses(self, family):
+        """
+        yields addresses of family in the order they were added
+        """
+        cursor = self.conn.execute('SELECT address FROM addresses WHERE family = ? ORDER BY rowid', (family.upper(),))
+        for row in cursor:
+            yield row[0]
+
+    def remove(self, family, addr_lst=[]):
+        """
+        removes each address in addr_lst from family, returns number of addresses removed
+        """
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany('DELETE FROM addresses WHERE family = ? AND address = ?',
+                                  ((family.upper(), addr) for addr in addr_lst))
+            return self.conn.total_changes - before
@@ -1,30 +1,88 @@
-import inspect
+import re
+import sys
 import json
-import requests
+import time
+import codecs
+import operator
+import itertools
 from queue import Queue
 import collections
+import functools
 
-__all__ = ['api_call', 'api_test_call', 'json_from_file', 'json_to_file', 'json_value_by_key',
-           'list_from_file', 'make_list_chunks', 'merge_lst', 'rev_eval', 'same_char_str']
+__all__ = ['api_call', 'api_test_call', 'compile_key_path', 'conditional_api_call', 'currency_list', 'iter_api_array',
+           'iter_json_array', 'json_from_file', 'json_to_file', 'json_value_by_key',
+           'list_from_file', 'make_list_chunks', 'merge_lst', 'parse_duration', 'same_char_str']
 
 ApiResponse = collections.namedtuple('ApiResponse', ['api_path', 'json_response'])
+ConditionalResponse = collections.namedtuple('ConditionalResponse', ['api_path', 'json_response', 'validators'])
 
-def api_call(api_base, api_path, results_queue=None):
+def api_call(api_base, api_path, results_queue=None, session=None):
     """
     If results_queue provided, json response from api call to api_base + api_path put into results_queue
     otherwise the json response is returned
+    If session provided, the request is made through it so pooled keep-alive connections are reused
+    Requests go through scheduler.default_scheduler which applies the rate limit, timeout and retries of the api host
+    Identical urls share a single request through singleflight.default_flight
     """
+    from src import singleflight
+
     url = api_base + api_path
     try:
-        raw_resp = requests.get(url).text
+        json_resp = singleflight.default_flight.call(url, _get_json, url, session)
         if results_queue and isinstance(results_queue, Queue):
-            resp = ApiResponse(api_path, json.loads(raw_resp))
+            resp = ApiResponse(api_path, json_resp)
             results_queue.put(resp)
             #results_queue.put([api_path, json.loads(raw_resp)])
         else:
-            return json.loads(raw_resp)
+            return json_resp
     except Exception as e:
-        print('Error occurred while requesting {0}'.format(url), e.args)
+        _report_error(url, e)
+
+def _get(url, session=None, headers=None, stream=False):
+    """
+    Returns the requests.Response for url from scheduler.default_scheduler, recorded by the default profiler
+    unless stream is true, in which case the body is left unread for the caller to stream and record
+    while archive.active records a run every response is written to it, while it replays one the recorded
+    response is returned without touching the network
+    """
+    from src import profiler, archive
+
+    start = time.perf_counter()
+    A = archive.active
+    try:
+        if A is not None and A.mode == 'replay':
+            raw_resp = A.response(url)
+        else:
+            # the network stack is imported on first use so config commands start without it
+            import requests
+            from src import scheduler
+
+            getter = session.get if session else requests.get
+            if headers or stream:
+                getter = functools.partial(getter, headers=headers, stream=stream)
+            raw_resp = scheduler.default_scheduler.request(url, getter)
+    except Exception:
+        profiler.default_profiler.record_request(url, start, 0, failed=True)
+        raise
+    if A is not None and A.mode == 'record':
+        A.record(url, raw_resp)
+    if not stream:
+        profiler.default_profiler.record_request(url, start, len(raw_resp.content))
+    return raw_resp
+
+def _get_json(url, session=None):
+    return _loads(_get(url, session))
+
+def _report_error(url, e):
+    from src import scheduler
+    # requests cut short by the run deadline are reported together as stale or missing balances instead
+    if not isinstance(e, scheduler.DeadlineExceeded):
+        print('Error occurred while requesting {0}'.format(url), e.args, file=sys.stderr)
+
+def _loads(raw_resp):
+    from src import profiler
+    with profiler.default_profiler.span('json.loads', 'parse'):
+        return json.loads(raw_resp.text)
 
 def chunk_list(lst, chunk_size):
     """
@@ -32,6 +90,178 @@ def chunk_list(lst, chunk_size):
     """
     return [lst[x : x+chunk_size] for x in range(0, len(lst), chunk_size)]
 
+def compile_key_path(key_lst=[]):
+    """
+    Returns a function which looks up json_obj[key] where key is a list of sub keys, i.e. json_obj['a']['b']['c']
+    Integer sub keys index into lists and a '*' sub key applies the rest of the path to every list element
+    or dict value, returning a list of the results
+    """
+    key_lst = list(key_lst)
+    if '*' in key_lst:
+        wildcard_idx = key_lst.index('*')
+        head = compile_key_path(key_lst[:wildcard_idx])
+        tail = compile_key_path(key_lst[wildcard_idx+1:])
+
+        def wildcard_getter(json_obj):
+            items = head(json_obj)
+            if isinstance(items, dict):
+                items = items.values()
+            return [tail(item) for item in items]
+        return wildcard_getter
+
+    if len(key_lst) == 0:
+        return lambda json_obj: json_obj
+    if len(key_lst) == 1:
+        return operator.itemgetter(key_lst[0])
+
+    def path_getter(json_obj):
+        for key in key_lst:
+            json_obj = json_obj[key]
+        return json_obj
+    return path_getter
+
+def conditional_api_call(api_base, api_path, validators=None, session=None):
+    """
+    Returns ConditionalResponse(api_path, json_response, validators) from api call to api_base + api_path, where
+    validators is {'etag', 'last_modified'} from a previous response, sent as If-None-Match and If-Modified-Since
+    json_response is None when the api answered 304 Not Modified, None is returned if the request failed
+    """
+    url = api_base + api_path
+    validators = validators or {}
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    try:
+        raw_resp = _get(url, session, headers)
+        if raw_resp.status_code == 304:
+            return ConditionalResponse(api_path, None, validators)
+        new_validators = {'etag': raw_resp.headers.get('ETag'), 'last_modified': raw_resp.headers.get('Last-Modified')}
+        return ConditionalResponse(api_path, _loads(raw_resp),
+                                   {key: value for key, value in new_validators.items() if value})
+    except Exception as e:
+        _report_error(url, e)
+
+def currency_list(currencies):
+    """
+    Returns list of upper case currency codes from a comma separated string such as 'USD,EUR,BTC' or a list
+    """
+    if isinstance(currencies, str):
+        currencies = currencies.split(',')
+    return [currency.strip().upper() for currency in currencies if currency.strip()]
+
+def iter_api_array(api_base, api_path, session=None, chunk_size=65536, raise_errors=False):
+    """
+    Yields each element of the json array returned by api call to api_base + api_path, decoded incrementally
+    as the response streams in so neither the whole response nor the whole decoded array is held in memory
+    If the request fails the error is raised if raise_errors is true, otherwise it is printed and nothing more
+    is yielded
+    """
+    from src import profiler
+
+    url = api_base + api_path
+    start = time.perf_counter()
+    nbytes = 0
+    try:
+        raw_resp = _get(url, session, stream=True)
+        with raw_resp:
+            def text_chunks():
+                nonlocal nbytes
+                decoder = codecs.getincrementaldecoder(raw_resp.encoding or 'utf-8')()
+                for chunk in raw_resp.iter_content(chunk_size):
+                    nbytes += len(chunk)
+                    yield decoder.decode(chunk)
+                yield decoder.decode(b'', final=True)
+            yield from iter_json_array(text_chunks())
+    except Exception as e:
+        if raise_errors:
+            raise
+        _report_error(url, e)
+    finally:
+        profiler.default_profiler.record_request(url, start, nbytes)
+
+_ARRAY_SEPARATORS = re.compile(r'[ \t\n\r,]*')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# element boundaries tried when looking for the last whole element of a buffer before decoding it element by element
+ELEMENT_END_ATTEMPTS = 8
+
+def _element_kind(char):
+    return char if char in '{["' else 'scalar'
+
+def _decode_elements(decoder, buf, pos):
+    """
+    Returns (elements, end) of the array elements of buf from pos up to the last element followed by a comma,
+    decoded in a single call, end being the position after that comma, or ([], pos) if none is found
+    A slice ending inside a string or a nested element leaves it open and never decodes, so a slice which
+    decodes ends at an element boundary
+    """
+    kind = _element_kind(buf[pos])
+    hi = len(buf)
+    for attempt in range(ELEMENT_END_ATTEMPTS):
+        if kind in '{[':
+            element_end = max(buf.rfind('}', pos, hi), buf.rfind(']', pos, hi))
+            comma = _WHITESPACE.match(buf, element_end + 1).end()
+        else:
+            element_end = comma = buf.rfind(',', pos, hi)
+        if element_end < pos:
+            break
+        next_start = _WHITESPACE.match(buf, comma + 1).end()
+        # elements of a feed are alike, a boundary not followed by the start of a like element is nested
+        if buf.startswith(',', comma) and (next_start == len(buf) or _element_kind(buf[next_start]) == kind):
+            try:
+                return decoder.decode('[' + buf[pos:comma] + ']'), comma + 1
+            except ValueError:
+                pass
+        hi = element_end
+    return [], pos
+
+def iter_json_array(text_chunks):
+    """
+    Yields each element of a json array whose text arrives as text_chunks, an element is decoded once all of it
+    has arrived, raises ValueError if the text is not a json array
+    The whole elements of each chunk are decoded together by one decoder call, only the elements left at the end
+    of a chunk are decoded one at a time, which keeps decoding about as fast as json.loads of the whole text
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    started = False
+    for chunk in itertools.chain(text_chunks, [None]):
+        final = chunk is None
+        buf = buf[pos:] + (chunk or '')
+        pos = 0
+        batched = False
+        while True:
+            pos = _ARRAY_SEPARATORS.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError('Expected a json array')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            if not batched:
+                batched = True
+                elements, pos = _decode_elements(decoder, buf, pos)
+                yield from elements
+                continue
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if final:
+                    raise
+                break
+            # a number cut off by the end of the buffer, such as 2. of 2.5, may continue in the next chunk
+            if not final and (end == len(buf) or buf[end] not in ' \t\n\r,]'):
+                break
+            yield element
+            pos = end
+    raise ValueError('Unterminated json array')
+
 def json_from_file(file_path):
     """
     Returns contents of file at file_path as json
@@ -52,9 +282,11 @@ def json_value_by_key(json_obj, key_lst=[]):
     """
     Returns value at json_obj[key] where key is a list of sub keys, i.e. json_obj['a']['b']['c']
     """
-    json_key_path = merge_lst(key_lst, ['[\'', '\']'])
-    str_stmt = rev_eval(json_obj) + json_key_path
-    return eval(str_stmt)
+    return _cached_key_path(tuple(key_lst))(json_obj)
+
+@functools.lru_cache(maxsize=128)
+def _cached_key_path(key_tpl):
+    return compile_key_path(key_tpl)
 
 def list_from_file(file_path):
     """
@@ -95,12 +327,15 @@ def merge_lst(lst, delimeters=['', '']):
         lst_str += delimeters[0] + element + delimeters[1]
     return lst_str
 
-def rev_eval(variable):
+def parse_duration(text):
     """
-    Returns string representation of variable name
+    Returns seconds from a duration such as '5s', '500ms', '2m' or '1h', plain numbers are seconds
     """
-    callers_local_vars = inspect.currentframe().f_back.f_locals.items()
-    return [k for k,v in callers_local_vars if v is variable][0]
+    text = text.strip().lower()
+    for suffix, scale in (('ms', 0.001), ('s', 1), ('m', 60), ('h', 3600)):
+        if text.endswith(suffix):
+            return float(text[:-len(suffix)]) * scale
+    return float(text)
 
 def same_char_str(str_obj, char_obj=None, exclusion_lst=[]):
     """
@@ -0,0 +1,58 @@
+import csv
+import json
+from decimal import Decimal
+
+FORMATS = ['table', 'jsonl', 'csv']
+
+class CsvWriter(object):
+    def __init__(self, out, fields):
+        """
+        writes rows to out as csv, starting with a header row of fields
+        """
+        self.writer = csv.writer(out, lineterminator='\n')
+        self.writer.writerow(fields)
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+class JsonLinesWriter(object):
+    def __init__(self, out, fields):
+        """
+        writes each row to out as a json object keyed by fields on its own line
+        """
+        self.out = out
+        self.fields = fields
+
+    def write(self, row):
+        self.out.write(json.dumps(dict(zip(self.fields, row))) + '\n')
+
+WRITERS = {'jsonl': JsonLinesWriter, 'csv': CsvWriter}
+
+def balance_fields(base_currencies, itemize=False):
+    """
+    returns field names of the rows made by balance_row(), prefixed with address and followed by the status of the
+    address, 'fresh', 'stale' or 'missing', when rows are itemized
+    """
+    fields = ['asset', 'balance'] + ['value_' + base_currency for base_currency in base_currencies]
+    return ['address'] + fields + ['status'] if itemize else fields
+
+def balance_row(asset_name, balance, asset_values, asset_prec_digits, value_prec_digits):
+    """
+    returns [asset_name, balance, value, ] with balance and each value formatted to a fixed number of decimal places
+    decimals are written as strings so no precision is lost to floats downstream
+    """
+    row = [asset_name, '{0:.{prec}f}'.format(Decimal(balance), prec=int(asset_prec_digits))]
+    row.extend('{0:.{prec}f}'.format(Decimal(value), prec=int(value_prec_digits)) for value in asset_values)
+    return row
+
+def missing_row(addr, base_currencies):
+    """
+    returns an itemized row for addr without balances, whose request failed and which has no last known balances
+    """
+    return [addr, None, None] + [None] * len(base_currencies) + ['missing']
+
+def writer(fmt, out, base_currencies, itemize=False):
+    """
+    returns the writer for fmt, one of 'jsonl' or 'csv', of balance rows to out
+    """
+    return WRITERS[fmt](out, balance_fields(base_currencies, itemize))